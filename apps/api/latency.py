@@ -0,0 +1,87 @@
+"""Compares first-request latency after warm-up with steady-state latency.
+
+Usage: python -m apps.api.latency <model dir> [--first N] [--steady N]
+
+Loads the model the way the server does, then times `predict` for the first N
+requests after loading, with and without warm-up, and for a steady-state sample
+taken afterwards. Every request uses distinct text, so the prediction cache never
+answers. Warm-up works if the warm first-request p99 matches the steady-state p99.
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+
+from apps.api.model import EmotionModel, create_model
+
+SENTENCES = (
+    "I woke up tired and it took a while to get going.",
+    "Work was busy but I finished the report I had been putting off.",
+    "Lunch with an old friend made me laugh more than I have in weeks.",
+    "Traffic on the way home was awful and I snapped at someone for no reason.",
+    "I'm worried about the appointment tomorrow.",
+    "In the evening I went for a long walk and felt calmer afterwards.",
+    "Honestly I don't know why I feel so flat today.",
+    "Grateful for a quiet night in.",
+)
+
+
+def make_texts(n: int, offset: int = 0) -> list[str]:
+    """Builds `n` distinct journal entries of one to all of SENTENCES."""
+    texts = []
+    for i in range(offset, offset + n):
+        count = i % len(SENTENCES) + 1
+        texts.append(" ".join(SENTENCES[:count]) + f" Entry {i}.")
+    return texts
+
+
+def time_requests(model: EmotionModel, texts: list[str]) -> np.ndarray:
+    timings = []
+    for text in texts:
+        start = time.perf_counter()
+        model.predict(text)
+        timings.append((time.perf_counter() - start) * 1000)
+    return np.asarray(timings)
+
+
+def load(model_dir: Path, warm_up: bool) -> EmotionModel:
+    model = create_model(model_dir)
+    model.load()
+    if warm_up:
+        model.warm_up()
+    return model
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("model_dir", type=Path)
+    parser.add_argument("--first", type=int, default=50, help="requests timed right after loading")
+    parser.add_argument("--steady", type=int, default=500, help="requests in the steady-state sample")
+    args = parser.parse_args()
+
+    cold = load(args.model_dir, warm_up=False)
+    cold_first = time_requests(cold, make_texts(args.first))
+    cold.close()
+
+    model = load(args.model_dir, warm_up=True)
+    warm_first = time_requests(model, make_texts(args.first, offset=args.first))
+    steady = time_requests(model, make_texts(args.steady, offset=2 * args.first))
+    model.close()
+
+    print(f"{'':<28}{'p50 (ms)':>10}{'p99 (ms)':>10}{'max (ms)':>10}")
+    for name, timings in (
+        (f"First {args.first}, no warm-up", cold_first),
+        (f"First {args.first}, warmed up", warm_first),
+        (f"Steady state ({args.steady})", steady),
+    ):
+        p50, p99 = np.percentile(timings, [50, 99])
+        print(f"{name:<28}{p50:>10.2f}{p99:>10.2f}{timings.max():>10.2f}")
+
+    ratio = np.percentile(warm_first, 99) / np.percentile(steady, 99)
+    print(f"\nWarm first-request p99 / steady-state p99: {ratio:.2f}")
+
+
+if __name__ == "__main__":
+    main()
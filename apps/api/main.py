@@ -1,18 +1,48 @@
+import hmac
+import os
+from contextlib import asynccontextmanager
 from pathlib import Path
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse
+from pydantic import BaseModel, Field
+
+from apps.api.model import create_model
+from apps.api.registry import ModelRegistry
 
 BASE_DIR = Path(__file__).resolve().parents[2]
 MODELS_DIR = BASE_DIR / "artifacts" / "models"
 WEB_DIST_DIR = BASE_DIR / "apps" / "web" / "dist"
+MODEL_ROOT = Path(os.getenv("MODEL_ROOT", MODELS_DIR / "journaling_model"))
+MODEL_VERSION = os.getenv("MODEL_VERSION", "v1")
+# Outside MODELS_DIR, which is served publicly
+MODEL_STATE_PATH = Path(os.getenv("MODEL_STATE_PATH", BASE_DIR / "artifacts" / "serving.json"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load and warm up in the background so static assets are served immediately
+    registry = ModelRegistry(MODEL_ROOT, create_model, MODEL_STATE_PATH, MODEL_VERSION)
+    app.state.registry = registry
+
+    # A state published by a reload since this deploy takes precedence over MODEL_VERSION
+    if registry.published_state() is not None:
+        registry.sync()
+    elif registry.available(MODEL_VERSION):
+        registry.load(MODEL_VERSION)
+    else:
+        registry.error = f"No model found for version {MODEL_VERSION} in {MODEL_ROOT}"
+
+    yield
 
 
 app = FastAPI(
     title="Emotion Classification Server",
     description="Static server for the web app and model artifacts.",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # Add CORS middleware
@@ -25,11 +55,97 @@ app.add_middleware(
 )
 
 
+def get_registry() -> ModelRegistry:
+    """Returns this worker's registry, synced to the state published by any worker."""
+    registry = app.state.registry
+    registry.sync()
+    return registry
+
+
 @app.get("/api/health")
 def health():
     return {"status": "ok"}
 
 
+@app.get("/api/ready")
+def ready():
+    registry = get_registry()
+    if not registry.ready:
+        status = "loading" if registry.loading else "unavailable"
+        return JSONResponse(
+            {"status": status, "detail": registry.error},
+            status_code=503,
+        )
+    with registry.acquire() as model:
+        return {"status": "ready", "version": model.version, "timings": model.timings}
+
+
+class PredictRequest(BaseModel):
+    text: str = Field(min_length=1)
+
+
+@app.post("/api/predict")
+def predict(request: PredictRequest):
+    registry = get_registry()
+    if not registry.ready:
+        raise HTTPException(status_code=503, detail="Model is not ready")
+    with registry.acquire() as model:
+        return {"version": model.version, **model.predict(request.text)}
+
+
+@app.get("/api/cache")
+def cache_stats():
+    registry = get_registry()
+    if not registry.ready:
+        raise HTTPException(status_code=503, detail="Model is not ready")
+    with registry.acquire() as model:
+        return {"version": model.version, **model.cache.stats()}
+
+
+class ReloadRequest(BaseModel):
+    version: str
+    canary_fraction: float = Field(default=0.0, ge=0.0, lt=1.0)
+
+
+def check_admin(authorization: str | None):
+    # Model management is disabled unless a token is configured
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Model admin endpoints are disabled")
+    if not hmac.compare_digest((authorization or "").encode(), f"Bearer {ADMIN_TOKEN}".encode()):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+
+@app.get("/api/model")
+def model_status():
+    return get_registry().status()
+
+
+@app.post("/api/model/reload", status_code=202)
+def reload_model(request: ReloadRequest, authorization: str | None = Header(default=None)):
+    check_admin(authorization)
+    registry = get_registry()
+    try:
+        registry.reload(request.version, request.canary_fraction)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return registry.status()
+
+
+@app.post("/api/model/promote")
+def promote_model(authorization: str | None = Header(default=None)):
+    check_admin(authorization)
+    registry = get_registry()
+    try:
+        registry.promote()
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return registry.status()
+
+
 app.mount(
     "/api/models",
     StaticFiles(directory=MODELS_DIR, html=False),
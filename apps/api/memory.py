@@ -0,0 +1,113 @@
+"""Reports unique vs shared resident memory of API worker processes.
+
+Usage: python -m apps.api.memory <server pid> [<pid> ...]
+
+Each pid's worker children are included. Figures come from /proc/<pid>/smaps,
+so this only runs on Linux.
+"""
+
+import re
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+
+PROC = Path("/proc")
+
+MODEL_SUFFIXES = (".onnx", ".onnx.data", ".safetensors")
+
+# Mapping header: "start-end perms offset dev inode [path]"
+MAPPING_HEADER = re.compile(r"^[0-9a-f]+-[0-9a-f]+\s")
+
+
+@dataclass
+class ProcessMemory:
+    pid: int
+    rss_kb: int = 0
+    pss_kb: int = 0
+    shared_kb: int = 0
+    unique_kb: int = 0
+    model_rss_kb: int = 0
+    model_unique_kb: int = 0
+
+
+def parse_smaps(pid: int, text: str) -> ProcessMemory:
+    """Sums the resident memory fields of an smaps file, tracking model file mappings separately."""
+    memory = ProcessMemory(pid)
+    in_model = False
+
+    for line in text.splitlines():
+        if MAPPING_HEADER.match(line):
+            parts = line.split()
+            path = parts[5] if len(parts) > 5 else ""
+            in_model = path.endswith(MODEL_SUFFIXES)
+            continue
+
+        key, _, rest = line.partition(":")
+        if not rest.strip().endswith("kB"):
+            continue
+        kb = int(rest.split()[0])
+
+        if key == "Rss":
+            memory.rss_kb += kb
+            if in_model:
+                memory.model_rss_kb += kb
+        elif key == "Pss":
+            memory.pss_kb += kb
+        elif key in ("Shared_Clean", "Shared_Dirty"):
+            memory.shared_kb += kb
+        elif key in ("Private_Clean", "Private_Dirty"):
+            memory.unique_kb += kb
+            if in_model:
+                memory.model_unique_kb += kb
+
+    return memory
+
+
+def read_memory(pid: int) -> ProcessMemory:
+    return parse_smaps(pid, (PROC / str(pid) / "smaps").read_text())
+
+
+def child_pids(pid: int) -> list[int]:
+    children = []
+    for stat in PROC.glob("[0-9]*/stat"):
+        try:
+            # The command name may contain spaces, so split after its closing paren
+            fields = stat.read_text().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(stat.parent.name))
+    return sorted(children)
+
+
+def main():
+    pids = [int(arg) for arg in sys.argv[1:]]
+    if not pids:
+        print(__doc__)
+        sys.exit(1)
+
+    processes = []
+    for pid in pids:
+        processes.append(pid)
+        processes.extend(child_pids(pid))
+
+    rows = [read_memory(pid) for pid in dict.fromkeys(processes)]
+
+    print(
+        f"{'PID':>8}{'RSS (MB)':>12}{'Unique (MB)':>14}{'Shared (MB)':>14}"
+        f"{'PSS (MB)':>12}{'Model RSS':>12}{'Model Unique':>14}"
+    )
+    for row in rows:
+        print(
+            f"{row.pid:>8}{row.rss_kb / 1024:>12.1f}{row.unique_kb / 1024:>14.1f}"
+            f"{row.shared_kb / 1024:>14.1f}{row.pss_kb / 1024:>12.1f}"
+            f"{row.model_rss_kb / 1024:>12.1f}{row.model_unique_kb / 1024:>14.1f}"
+        )
+
+    # PSS splits shared pages between the processes mapping them
+    print(f"\nTotal PSS: {sum(row.pss_kb for row in rows) / 1024:.1f} MB")
+    print(f"Total RSS: {sum(row.rss_kb for row in rows) / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
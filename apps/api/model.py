@@ -0,0 +1,239 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import onnxruntime as ort
+from tokenizers import Tokenizer
+
+from ml.cache import PredictionCache
+from ml.config import load_config
+from ml.fingerprint import files_signature, model_fingerprint
+
+logger = logging.getLogger(__name__)
+
+cfg = load_config()
+
+MAX_LENGTH = cfg.training.max_length
+TAU = cfg.inference.tau
+
+CACHE_SIZE = int(os.getenv("CACHE_SIZE", "10000"))
+CACHE_PATH = os.getenv("CACHE_PATH")
+
+# Typical chunk lengths and batch sizes seen by the predict endpoint
+WARMUP_LENGTHS = (16, 32, 64, 128)
+WARMUP_BATCH_SIZES = (1, 4, 8)
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def segment_sentences(text: str) -> list[str]:
+    """Segments the input text into overlapping chunks, mirroring the web app."""
+    sentences = [s.strip() for s in SENTENCE_END.split(text) if s.strip()]
+    return [
+        sentences[0] if i == 0 else f"{sentences[i - 1]} {sentences[i]}"
+        for i in range(len(sentences))
+    ]
+
+
+def lse_pool(logits: np.ndarray, tau: float = TAU) -> np.ndarray:
+    scaled = tau * logits
+    peak = scaled.max(axis=0)
+    lse = peak + np.log(np.exp(scaled - peak).sum(axis=0))
+    return (lse - np.log(logits.shape[0])) / tau
+
+
+@dataclass(frozen=True)
+class Calibration:
+    """Labels, temperatures and thresholds read together, with a key for the temperatures."""
+
+    labels: list[str]
+    temperatures: np.ndarray
+    thresholds: np.ndarray
+    key: str
+
+
+class EmotionModel:
+    """ONNX emotion classifier loaded from an exported model directory."""
+
+    def __init__(self, model_dir: Path, model_file: str = "onnx/model_quantized.onnx"):
+        self.model_dir = Path(model_dir)
+        self.model_file = model_file
+        self.model_path = self.model_dir / model_file
+        self.version = self.model_dir.name
+        self.session: ort.InferenceSession | None = None
+        self.cache: PredictionCache | None = None
+        self.timings: dict[str, float] = {}
+        self.calibration_files = (
+            self.model_dir / "thresholds.json",
+            self.model_dir / "temperatures.json",
+        )
+        self.calibration_signature: str | None = None
+        self._calibration_lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        return self.model_path.exists()
+
+    def session_options(self) -> ort.SessionOptions:
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        return options
+
+    def load(self):
+        """Loads the tokenizer, calibration and ONNX session."""
+        start = time.perf_counter()
+
+        self.tokenizer = Tokenizer.from_file(str(self.model_dir / "tokenizer.json"))
+        self.tokenizer.enable_truncation(MAX_LENGTH)
+        self.tokenizer.enable_padding()
+
+        self.load_calibration()
+        # Only the served graph and tokenizer; the full export dir holds hundreds of MB of other weights
+        self.fingerprint = model_fingerprint(
+            self.model_dir, TAU, files=(self.model_file, "tokenizer.json")
+        )
+        self.cache = PredictionCache(
+            max_entries=CACHE_SIZE,
+            disk_path=Path(CACHE_PATH) if CACHE_PATH else None,
+        )
+
+        self.session = ort.InferenceSession(
+            str(self.model_path),
+            sess_options=self.session_options(),
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        self.timings["load_ms"] = (time.perf_counter() - start) * 1000
+        logger.info("Loaded model %s in %.0f ms", self.version, self.timings["load_ms"])
+
+    def load_calibration(self):
+        """Reads the calibration files into a new snapshot."""
+        # Taken before reading, so a change during the read is picked up next time
+        signature = files_signature(self.calibration_files)
+
+        with (self.model_dir / "temperatures.json").open() as f:
+            temperature_dict = json.load(f)
+        with (self.model_dir / "thresholds.json").open() as f:
+            threshold_dict = json.load(f)
+
+        labels = list(temperature_dict)
+        # Label order matters too: it is the order of the probabilities
+        key = hashlib.sha256(json.dumps(temperature_dict).encode()).hexdigest()
+        self.calibration = Calibration(
+            labels=labels,
+            temperatures=np.asarray([temperature_dict[label] for label in labels]),
+            thresholds=np.asarray([threshold_dict[label] for label in labels]),
+            key=key[:16],
+        )
+        self.calibration_signature = signature
+
+    def refresh_calibration(self) -> Calibration:
+        """Returns the current calibration, re-reading the files if they changed."""
+        if files_signature(self.calibration_files) != self.calibration_signature:
+            with self._calibration_lock:
+                if files_signature(self.calibration_files) != self.calibration_signature:
+                    self.load_calibration()
+        return self.calibration
+
+    def close(self):
+        """Drops the ONNX session and cache so their memory can be freed."""
+        self.session = None
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+
+    def run(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        assert self.session is not None
+
+        inputs = {
+            "input_ids": input_ids,
+            "attention_mask": attention_mask,
+            "token_type_ids": np.zeros_like(input_ids),
+        }
+        (logits, *_) = self.session.run(
+            None,
+            {k: v for k, v in inputs.items() if k in self.input_names},
+        )
+        return logits
+
+    def warm_up(self):
+        """Runs synthetic batches across typical sequence lengths so first requests hit steady state."""
+        start = time.perf_counter()
+        token_id = self.tokenizer.get_vocab_size() // 2
+
+        for length in WARMUP_LENGTHS:
+            for batch_size in WARMUP_BATCH_SIZES:
+                shape_start = time.perf_counter()
+                ids = np.full((batch_size, length), token_id, dtype=np.int64)
+                self.run(ids, np.ones_like(ids))
+                self.timings[f"warmup_{batch_size}x{length}_ms"] = (
+                    time.perf_counter() - shape_start
+                ) * 1000
+
+        self.timings["warmup_ms"] = (time.perf_counter() - start) * 1000
+        logger.info("Warmed up model %s in %.0f ms", self.version, self.timings["warmup_ms"])
+
+    def predict_logits(self, text: str) -> np.ndarray:
+        """Predicts pooled, uncalibrated logits for a document."""
+        chunks = segment_sentences(text) or [text]
+        encodings = self.tokenizer.encode_batch(chunks)
+
+        input_ids = np.asarray([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.asarray([e.attention_mask for e in encodings], dtype=np.int64)
+
+        return lse_pool(self.run(input_ids, attention_mask))
+
+    def predict(self, text: str) -> dict[str, dict]:
+        assert self.cache is not None
+
+        # One snapshot per request; cached probabilities are keyed by its temperatures
+        calibration = self.refresh_calibration()
+        model_key = f"{self.fingerprint}:{calibration.key}"
+
+        probabilities = self.cache.get(text, model_key)
+        if probabilities is None:
+            logits = self.predict_logits(text) / calibration.temperatures
+            probabilities = 1 / (1 + np.exp(-logits))
+            self.cache.put(text, model_key, probabilities)
+
+        return {
+            "probabilities": dict(zip(calibration.labels, probabilities.tolist())),
+            "predictions": dict(
+                zip(calibration.labels, (probabilities >= calibration.thresholds).tolist())
+            ),
+        }
+
+
+class SharedEmotionModel(EmotionModel):
+    """Emotion classifier whose weights are memory-mapped from the page cache.
+
+    Loads the `model_shared.onnx` export, whose initializers live in a page-aligned
+    external data file. ONNX Runtime maps that file instead of copying it, and with
+    graph optimization and weight prepacking disabled the mapped pages are never
+    written, so all worker processes share one physical copy of the weights.
+    """
+
+    def __init__(self, model_dir: Path, model_file: str = "onnx/model_shared.onnx"):
+        super().__init__(model_dir, model_file)
+
+    def session_options(self) -> ort.SessionOptions:
+        options = ort.SessionOptions()
+        # Already optimized at export time
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        options.add_session_config_entry("session.disable_prepacking", "1")
+        return options
+
+
+def create_model(model_dir: Path) -> EmotionModel:
+    """Creates the model class selected by the MODEL_SHARED environment variable."""
+    if os.getenv("MODEL_SHARED", "0") == "1":
+        return SharedEmotionModel(model_dir)
+    return EmotionModel(model_dir)
@@ -0,0 +1,330 @@
+import json
+import logging
+import os
+import random
+import re
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator
+
+from apps.api.model import EmotionModel
+
+logger = logging.getLogger(__name__)
+
+VERSION_PATTERN = re.compile(r"^[\w.-]+$")
+
+
+class ModelRegistry:
+    """Holds the served model versions and swaps new versions in without downtime.
+
+    New versions are loaded and warmed up on a background thread, then swapped in
+    atomically. Requests lease a model for their duration, so in-flight requests
+    finish on the version they started with; a replaced version is released once
+    its last lease is returned. With a canary fraction, the new version serves that
+    share of requests alongside the current one until it is promoted.
+
+    Each worker process has its own registry. Reloads and promotions are published
+    to `state_path`, and `sync()` brings every other worker to the published state
+    when it next handles a request. A published state records the `default_version`
+    it was made under and is ignored once a deploy changes it, and a worker with
+    nothing to serve falls back to `default_version`.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        factory: Callable[[Path], EmotionModel],
+        state_path: Path | None = None,
+        default_version: str | None = None,
+    ):
+        self.root = Path(root)
+        self.factory = factory
+        self.state_path = Path(state_path) if state_path is not None else None
+        self.default_version = default_version
+        self.active: EmotionModel | None = None
+        self.canary: EmotionModel | None = None
+        self.canary_fraction = 0.0
+        self.loading: str | None = None
+        self.error: str | None = None
+
+        self._lock = threading.Lock()
+        self._leases: dict[int, int] = {}
+        self._retired: dict[int, EmotionModel] = {}
+        self._state: dict | None = None
+        self._state_signature: tuple | None = None
+        self._synced_signature: tuple | None = None
+        self._failed_signature: tuple | None = None
+
+    def model_dir(self, version: str) -> Path:
+        if not VERSION_PATTERN.match(version) or version in (".", ".."):
+            raise ValueError(f"Invalid model version: {version!r}")
+        return self.root / version
+
+    def available(self, version: str) -> bool:
+        return self.factory(self.model_dir(version)).available
+
+    @property
+    def ready(self) -> bool:
+        return self.active is not None
+
+    def reload(self, version: str, canary_fraction: float = 0.0) -> threading.Thread:
+        """Loads and warms up a version in the background, then swaps it in or starts a canary.
+
+        Once the swap succeeds, the resulting serving state is published so other
+        workers follow.
+        """
+        return self.load(version, canary_fraction, publish=True)
+
+    def load(
+        self, version: str, canary_fraction: float = 0.0, publish: bool = False
+    ) -> threading.Thread:
+        """Like reload, but only publishes the new state if `publish` is set."""
+        if not 0.0 <= canary_fraction < 1.0:
+            raise ValueError("canary_fraction must be in [0, 1)")
+
+        model = self.factory(self.model_dir(version))
+        if not model.available:
+            raise FileNotFoundError(f"No model found at {model.model_path}")
+
+        with self._lock:
+            if self.loading is not None:
+                raise RuntimeError(f"Version {self.loading} is already loading")
+            self.loading = version
+
+        def load():
+            try:
+                model.load()
+                model.warm_up()
+            except Exception as e:
+                logger.exception("Failed to load model version %s", version)
+                with self._lock:
+                    self.error = str(e)
+                    self.loading = None
+                    if not publish:
+                        # Started by sync; don't retry this state
+                        self._failed_signature = self._synced_signature
+                if version != self.default_version:
+                    self.fall_back()
+                return
+
+            with self._lock:
+                self.error = None
+                self.loading = None
+                if canary_fraction > 0 and self.active is not None:
+                    self._retire(self.canary)
+                    self.canary = model
+                    self.canary_fraction = canary_fraction
+                    state = (self.active.version, version, canary_fraction)
+                else:
+                    self._retire(self.active)
+                    self._retire(self.canary)
+                    self.active = model
+                    self.canary = None
+                    self.canary_fraction = 0.0
+                    state = (version,)
+            logger.info("Model version %s is live", version)
+            if publish:
+                self.publish(*state)
+
+        thread = threading.Thread(target=load, name=f"load-{version}", daemon=True)
+        thread.start()
+        return thread
+
+    def fall_back(self):
+        """Loads `default_version` if this worker has nothing to serve."""
+        with self._lock:
+            if self.active is not None or self.default_version is None:
+                return
+        logger.warning("Falling back to model version %s", self.default_version)
+        try:
+            self.load(self.default_version)
+        except (ValueError, FileNotFoundError, RuntimeError) as e:
+            logger.warning("Could not fall back to %s: %s", self.default_version, e)
+
+    def promote(self):
+        """Makes the canary version the only served version, in every worker."""
+        state = self.published_state()
+        with self._lock:
+            has_canary = self.canary is not None
+        if not has_canary and state is not None and state["canary"] is not None:
+            # This worker hasn't loaded the canary yet; it picks it up on its next sync
+            self.publish(state["canary"])
+            return
+
+        self.promote_local()
+        assert self.active is not None
+        self.publish(self.active.version)
+
+    def promote_local(self):
+        with self._lock:
+            if self.canary is None:
+                raise RuntimeError("No canary version to promote")
+            self._retire(self.active)
+            self.active = self.canary
+            self.canary = None
+            self.canary_fraction = 0.0
+
+    def drop_canary(self):
+        with self._lock:
+            self._retire(self.canary)
+            self.canary = None
+            self.canary_fraction = 0.0
+
+    def state_signature(self) -> tuple | None:
+        assert self.state_path is not None
+        try:
+            stat = self.state_path.stat()
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def publish(self, active: str, canary: str | None = None, canary_fraction: float = 0.0):
+        """Records the serving state for the other workers to sync to."""
+        if self.state_path is None:
+            return
+
+        state = {
+            "active": active,
+            "canary": canary,
+            "canary_fraction": canary_fraction,
+            "default_version": self.default_version,
+        }
+        # Write then rename, so workers never read a partial file
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.state_path.with_name(f".{self.state_path.name}.{os.getpid()}")
+        tmp_path.write_text(json.dumps(state))
+        tmp_path.replace(self.state_path)
+
+        # Already applied here
+        signature = self.state_signature()
+        with self._lock:
+            self._state = state
+            self._state_signature = signature
+            self._synced_signature = signature
+
+    def published_state(self) -> dict | None:
+        """Reads the published serving state, re-reading the file only when it changes.
+
+        A state published under a different `default_version` (an earlier deploy)
+        is ignored.
+        """
+        if self.state_path is None:
+            return None
+
+        signature = self.state_signature()
+        if signature != self._state_signature:
+            state = None
+            if signature is not None:
+                try:
+                    state = json.loads(self.state_path.read_text())
+                    state = {
+                        key: state[key]
+                        for key in ("active", "canary", "canary_fraction", "default_version")
+                    }
+                except (OSError, ValueError, KeyError, TypeError):
+                    logger.exception("Could not read serving state from %s", self.state_path)
+                    state = None
+                if state is not None and state["default_version"] != self.default_version:
+                    logger.info("Ignoring serving state from an earlier deploy: %s", state)
+                    state = None
+            with self._lock:
+                self._state = state
+                self._state_signature = signature
+        return self._state
+
+    def sync(self) -> threading.Thread | None:
+        """Moves this worker one step towards the published serving state.
+
+        Called on every request; it is a stat() call unless the state changed. A
+        state whose load failed here is not retried until a new one is published.
+        Returns the loading thread if a load was started.
+        """
+        state = self.published_state()
+        if state is None:
+            return None
+
+        with self._lock:
+            if self.loading is not None:
+                return None
+            if self._failed_signature is not None and self._failed_signature == self._state_signature:
+                return None
+            active = self.active.version if self.active is not None else None
+            canary = self.canary.version if self.canary is not None else None
+            canary_fraction = self.canary_fraction
+            signature = self._state_signature
+
+        try:
+            if state["active"] != active:
+                if state["active"] == canary:
+                    self.promote_local()
+                else:
+                    self._synced_signature = signature
+                    return self.load(state["active"])
+            elif state["canary"] != canary:
+                if state["canary"] is None:
+                    self.drop_canary()
+                else:
+                    self._synced_signature = signature
+                    return self.load(state["canary"], state["canary_fraction"])
+            elif state["canary_fraction"] != canary_fraction:
+                with self._lock:
+                    self.canary_fraction = state["canary_fraction"]
+        except RuntimeError:
+            # Another request started a load first
+            return None
+        except (ValueError, FileNotFoundError) as e:
+            logger.warning("Could not sync to serving state %s: %s", state, e)
+            with self._lock:
+                self.error = str(e)
+                self._synced_signature = signature
+                self._failed_signature = signature
+            self.fall_back()
+        return None
+
+    @contextmanager
+    def acquire(self) -> Iterator[EmotionModel]:
+        """Leases a model for the duration of a request."""
+        with self._lock:
+            model = self.active
+            if self.canary is not None and random.random() < self.canary_fraction:
+                model = self.canary
+            if model is None:
+                raise RuntimeError("Model is not ready")
+            self._leases[id(model)] = self._leases.get(id(model), 0) + 1
+
+        try:
+            yield model
+        finally:
+            with self._lock:
+                self._leases[id(model)] -= 1
+                if self._leases[id(model)] == 0:
+                    del self._leases[id(model)]
+                    if id(model) in self._retired:
+                        self._free(self._retired.pop(id(model)))
+
+    def _retire(self, model: EmotionModel | None):
+        # Called with the lock held
+        if model is None:
+            return
+        if self._leases.get(id(model), 0) == 0:
+            self._free(model)
+        else:
+            self._retired[id(model)] = model
+
+    def _free(self, model: EmotionModel):
+        model.close()
+        logger.info("Released model version %s", model.version)
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "active": self.active.version if self.active else None,
+                "canary": self.canary.version if self.canary else None,
+                "canary_fraction": self.canary_fraction,
+                "loading": self.loading,
+                "retired": sorted(m.version for m in self._retired.values()),
+                "error": self.error,
+                "pid": os.getpid(),
+                "published": self._state,
+            }
@@ -0,0 +1,155 @@
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+from ml.config import load_config
+from ml.fingerprint import normalized_text_hash
+
+cfg = load_config()
+
+# Puts between trims of the on-disk tier
+PRUNE_INTERVAL = 1000
+
+
+class PredictionCache:
+    """Bounded LRU cache of calibrated document probabilities with an optional on-disk tier.
+
+    Entries are keyed by normalized-text hash and a model key, which must cover
+    everything the probabilities depend on: the model fingerprint and the
+    calibration (temperatures) they were computed with. A recalibrated or new model
+    therefore uses new keys, and nothing is ever deleted for another model's sake;
+    stale entries age out of the LRU, and the disk tier is capped at
+    `max_disk_entries` least recently used rows. Several processes and model
+    versions can share one disk file.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = cfg.cache.max_entries,
+        disk_path: Path | None = cfg.cache.disk_path,
+        max_disk_entries: int = cfg.cache.max_disk_entries,
+    ):
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+
+        self.entries: OrderedDict[str, np.ndarray] = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.memory_bytes = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+
+        self.conn = None
+        if disk_path is not None:
+            Path(disk_path).parent.mkdir(parents=True, exist_ok=True)
+            self.conn = sqlite3.connect(disk_path, check_same_thread=False, timeout=30)
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    probs BLOB NOT NULL,
+                    accessed REAL NOT NULL
+                )
+                """
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+            self.conn.commit()
+
+    @staticmethod
+    def key(text: str, model_key: str) -> str:
+        return f"{model_key}:{normalized_text_hash(text)}"
+
+    @staticmethod
+    def entry_bytes(key: str, probs: np.ndarray) -> int:
+        return sys.getsizeof(key) + probs.nbytes
+
+    def get(self, text: str, model_key: str) -> np.ndarray | None:
+        key = self.key(text, model_key)
+        with self._lock:
+            probs = self.entries.get(key)
+            if probs is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return probs
+
+            if self.conn is not None:
+                row = self.conn.execute("SELECT probs FROM entries WHERE key = ?", [key]).fetchone()
+                if row is not None:
+                    probs = np.frombuffer(row[0], dtype=np.float64)
+                    self.conn.execute(
+                        "UPDATE entries SET accessed = ? WHERE key = ?", [time.time(), key]
+                    )
+                    self.conn.commit()
+                    self._insert(key, probs)
+                    self.disk_hits += 1
+                    return probs
+
+            self.misses += 1
+            return None
+
+    def put(self, text: str, model_key: str, probs: np.ndarray):
+        key = self.key(text, model_key)
+        probs = np.asarray(probs, dtype=np.float64)
+        with self._lock:
+            self._insert(key, probs)
+            if self.conn is not None:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, probs, accessed) VALUES (?, ?, ?)",
+                    [key, probs.tobytes(), time.time()],
+                )
+                self._puts += 1
+                if self._puts % PRUNE_INTERVAL == 0:
+                    self._prune()
+                self.conn.commit()
+
+    def _prune(self):
+        # Called with the lock held; drops the least recently used rows over the cap
+        assert self.conn is not None
+        self.conn.execute(
+            """
+            DELETE FROM entries WHERE key IN (
+                SELECT key FROM entries ORDER BY accessed DESC LIMIT -1 OFFSET ?
+            )
+            """,
+            [self.max_disk_entries],
+        )
+
+    def _insert(self, key: str, probs: np.ndarray):
+        # Called with the lock held
+        if self.max_entries <= 0:
+            return
+        if key in self.entries:
+            self.memory_bytes -= self.entry_bytes(key, self.entries.pop(key))
+        self.entries[key] = probs
+        self.memory_bytes += self.entry_bytes(key, probs)
+
+        while len(self.entries) > self.max_entries:
+            old_key, old_probs = self.entries.popitem(last=False)
+            self.memory_bytes -= self.entry_bytes(old_key, old_probs)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "memory_bytes": self.memory_bytes,
+            }
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
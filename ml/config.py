@@ -1,9 +1,12 @@
 from pathlib import Path
+from typing import Literal
 from pydantic import BaseModel, field_validator
 
 import yaml
 
 CONFIG_PATH = Path(__file__).resolve().parent / "config.yaml"
+# Written by ml.tune; values here override config.yaml
+OVERLAY_PATH = Path(__file__).resolve().parent / "config.tuned.yaml"
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
 
 
@@ -34,6 +37,15 @@ class EpochConfig(BaseModel):
     classifier: int
 
 
+class CpuTrainingConfig(BaseModel):
+    bf16: bool = True
+    num_threads: int | None = None
+    interop_threads: int | None = None
+    affinity: list[int] | None = None
+    compile: bool = False
+    cache_tokenization: bool = True
+
+
 class TrainingConfig(BaseModel):
     output_dir: Path
 
@@ -47,14 +59,23 @@ class TrainingConfig(BaseModel):
     sampling_strategy: str
     max_length: int
 
+    cpu: CpuTrainingConfig = CpuTrainingConfig()
+
     @field_validator("output_dir", mode="before")
     @classmethod
     def resolve_path(cls, v):
         return (PROJECT_ROOT / v).resolve()
 
 
+class PipelineConfig(BaseModel):
+    batch_size: int
+    prefetch: int
+    workers: int
+
+
 class InferenceConfig(BaseModel):
     tau: float
+    pipeline: PipelineConfig
 
 
 class EvaluationConfig(BaseModel):
@@ -77,6 +98,65 @@ class ExportConfig(BaseModel):
         return (PROJECT_ROOT / v).resolve()
 
 
+class StoreConfig(BaseModel):
+    path: Path
+
+    @field_validator("path", mode="before")
+    @classmethod
+    def resolve_path(cls, v):
+        return (PROJECT_ROOT / v).resolve()
+
+
+class DistillationConfig(BaseModel):
+    strategy: Literal["pretrained", "drop_layers"]
+    student: str
+    unlabeled: list[Path]
+    text_column: str
+
+    output_dir: Path
+    export_dir: Path
+
+    epochs: int
+    batch_size: int
+    learning_rate: float
+    embedding_weight: float
+    logit_weight: float
+
+    @field_validator("unlabeled", mode="before")
+    @classmethod
+    def resolve_paths(cls, v):
+        return [(PROJECT_ROOT / p).resolve() for p in v or []]
+
+    @field_validator("output_dir", "export_dir", mode="before")
+    @classmethod
+    def resolve_path(cls, v):
+        return (PROJECT_ROOT / v).resolve()
+
+
+class CacheConfig(BaseModel):
+    max_entries: int
+    disk_path: Path | None = None
+    max_disk_entries: int = 1_000_000
+
+    @field_validator("disk_path", mode="before")
+    @classmethod
+    def resolve_path(cls, v):
+        return (PROJECT_ROOT / v).resolve() if v else None
+
+
+class TuningConfig(BaseModel):
+    storage: Path
+    study_name: str
+    n_trials: int
+    n_workers: int
+    classifier_step_epochs: int
+
+    @field_validator("storage", mode="before")
+    @classmethod
+    def resolve_path(cls, v):
+        return (PROJECT_ROOT / v).resolve()
+
+
 class ProjectConfig(BaseModel):
     seed: int
 
@@ -89,8 +169,28 @@ class Config(BaseModel):
     inference: InferenceConfig
     evaluation: EvaluationConfig
     export: ExportConfig
+    store: StoreConfig
+    cache: CacheConfig
+    tuning: TuningConfig
+    distillation: DistillationConfig
+
+
+def merge_overlay(base: dict, overlay: dict) -> dict:
+    merged = dict(base)
+    for key, value in overlay.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_overlay(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
 
 
 def load_config() -> Config:
     with CONFIG_PATH.open() as f:
-        return Config.model_validate(yaml.safe_load(f))
+        data = yaml.safe_load(f)
+
+    if OVERLAY_PATH.exists():
+        with OVERLAY_PATH.open() as f:
+            data = merge_overlay(data, yaml.safe_load(f) or {})
+
+    return Config.model_validate(data)
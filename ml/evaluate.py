@@ -1,4 +1,6 @@
-import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
 
 import numpy as np
 import pandas as pd
@@ -15,7 +17,7 @@ from sklearn.metrics import (
 
 from ml.config import load_config
 from ml.data import load_journaling_dataset
-from ml.inference import predict_document_logits
+from ml.inference import load_calibration, predict_document_logits
 
 cfg = load_config()
 
@@ -25,24 +27,26 @@ TEMPERATURE_PATH = cfg.evaluation.temperature_file
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 
 
-def evaluate_model():
+METRICS = ("Macro F1", "Micro F1", "Macro ROC AUC", "Hamming Loss")
 
+
+def predict_test_scores(
+    model_dir: Path = cfg.training.output_dir,
+    threshold_path: Path = THRESHOLD_PATH,
+    temperature_path: Path = TEMPERATURE_PATH,
+):
+    """Predicts calibrated test-set probabilities and returns them with the labels and thresholds."""
     dataset, label_names, _, _ = load_journaling_dataset()
 
     model = SetFitModel.from_pretrained(
-        cfg.training.output_dir,
+        model_dir,
         device=DEVICE,
     )
 
-    with THRESHOLD_PATH.open() as f:
-        threshold_dict = json.load(f)
-
-    with TEMPERATURE_PATH.open() as f:
-        temperature_dict = json.load(f)
-
-    temperatures = np.asarray(
-        [temperature_dict[label] for label in label_names],
-        dtype=float,
+    thresholds, temperatures = load_calibration(
+        label_names,
+        threshold_path,
+        temperature_path,
     )
 
     y_true = np.asarray(dataset["test"]["labels"])
@@ -54,11 +58,15 @@ def evaluate_model():
 
     y_score = scipy.special.expit(logits / temperatures)
 
-    thresholds = np.asarray(
-        [threshold_dict[label] for label in label_names],
-        dtype=float,
-    )
+    return y_true, y_score, thresholds, label_names
+
 
+def compute_metrics(
+    y_true: np.ndarray,
+    y_score: np.ndarray,
+    thresholds: np.ndarray,
+    label_names: list[str],
+):
     y_pred = (y_score >= thresholds).astype(int)
 
     macro_f1 = f1_score(
@@ -101,8 +109,156 @@ def evaluate_model():
     return metrics, report
 
 
-if __name__ == "__main__":
-    metrics, report = evaluate_model()
+def evaluate_model(
+    model_dir: Path = cfg.training.output_dir,
+    threshold_path: Path = THRESHOLD_PATH,
+    temperature_path: Path = TEMPERATURE_PATH,
+):
+    return compute_metrics(
+        *predict_test_scores(
+            model_dir,
+            threshold_path,
+            temperature_path,
+        )
+    )
+
+
+def resample_counts(n: int, n_resamples: int, seed: int = cfg.project.seed) -> np.ndarray:
+    """Draws all bootstrap resamples as one index matrix and returns per-row counts of shape (B, n)."""
+    rng = np.random.default_rng(seed)
+    idx = rng.integers(0, n, size=(n_resamples, n))
+    offsets = np.arange(n_resamples)[:, None] * n
+    return np.bincount((idx + offsets).ravel(), minlength=n_resamples * n).reshape(n_resamples, n)
+
+
+def f1_from_counts(tp: np.ndarray, fp: np.ndarray, fn: np.ndarray) -> np.ndarray:
+    """F1 with zero_division=0, elementwise over confusion counts."""
+    denom = 2 * tp + fp + fn
+    return np.divide(2 * tp, denom, out=np.zeros_like(denom, dtype=float), where=denom > 0)
+
+
+def weighted_auc(
+    counts: np.ndarray,
+    y_true: np.ndarray,
+    y_score: np.ndarray,
+) -> np.ndarray:
+    """ROC AUC per resample and label, computed as a weighted Mann-Whitney statistic.
+
+    Returns shape (B, L); labels without both classes in a resample are NaN.
+    """
+    aucs = np.full((counts.shape[0], y_true.shape[1]), np.nan)
+
+    for label in range(y_true.shape[1]):
+        order = np.argsort(y_score[:, label], kind="stable")
+        scores = y_score[order, label]
+        positive = y_true[order, label].astype(bool)
+
+        w = counts[:, order].astype(float)
+        w_pos = w * positive
+        w_neg = w * ~positive
+
+        # Negatives strictly below each score, plus half of those tied with it
+        group = np.r_[0, np.cumsum(scores[1:] != scores[:-1])]
+        neg_by_group = np.zeros((w.shape[0], group[-1] + 1))
+        np.add.at(neg_by_group.T, group, w_neg.T)
+        neg_below = np.cumsum(neg_by_group, axis=1) - neg_by_group
+
+        ranks = neg_below[:, group] + 0.5 * neg_by_group[:, group]
+        n_pos = w_pos.sum(axis=1)
+        n_neg = w_neg.sum(axis=1)
+
+        valid = (n_pos > 0) & (n_neg > 0)
+        aucs[valid, label] = (w_pos * ranks).sum(axis=1)[valid] / (n_pos * n_neg)[valid]
+
+    return aucs
+
+
+def bootstrap_metrics(
+    y_true: np.ndarray,
+    y_score: np.ndarray,
+    thresholds: np.ndarray,
+    counts: np.ndarray,
+    n_jobs: int = 1,
+) -> dict[str, np.ndarray]:
+    """Computes the test metrics for every resample in `counts` (see resample_counts)."""
+    y_true = np.asarray(y_true)
+    y_pred = (y_score >= thresholds).astype(int)
+    w = counts.astype(float)
+
+    tp = w @ (y_true * y_pred)
+    fp = w @ ((1 - y_true) * y_pred)
+    fn = w @ (y_true * (1 - y_pred))
+
+    if n_jobs > 1:
+        chunks = np.array_split(counts, n_jobs)
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            aucs = np.concatenate(
+                list(pool.map(weighted_auc, chunks, [y_true] * n_jobs, [y_score] * n_jobs))
+            )
+    else:
+        aucs = weighted_auc(counts, y_true, y_score)
+
+    return {
+        "Macro F1": f1_from_counts(tp, fp, fn).mean(axis=1),
+        "Micro F1": f1_from_counts(tp.sum(axis=1), fp.sum(axis=1), fn.sum(axis=1)),
+        # Labels missing a class in a resample are left out of the average
+        "Macro ROC AUC": np.nanmean(aucs, axis=1),
+        "Hamming Loss": (fp + fn).sum(axis=1) / (w.sum(axis=1) * y_true.shape[1]),
+    }
+
+
+def confidence_intervals(
+    samples: dict[str, np.ndarray],
+    alpha: float = 0.05,
+) -> pd.DataFrame:
+    """Summarizes bootstrap samples as mean and percentile interval per metric."""
+    return pd.DataFrame(
+        {
+            name: {
+                "Mean": np.nanmean(values),
+                "Lower": np.nanquantile(values, alpha / 2),
+                "Upper": np.nanquantile(values, 1 - alpha / 2),
+            }
+            for name, values in samples.items()
+        }
+    ).T
+
+
+def paired_bootstrap(
+    y_true: np.ndarray,
+    a: tuple[np.ndarray, np.ndarray],
+    b: tuple[np.ndarray, np.ndarray],
+    n_resamples: int = 2000,
+    alpha: float = 0.05,
+    n_jobs: int = 1,
+) -> pd.DataFrame:
+    """Compares two variants' (scores, thresholds) on the same resamples and reports b - a per metric."""
+    counts = resample_counts(len(y_true), n_resamples)
+    samples_a = bootstrap_metrics(y_true, *a, counts, n_jobs)
+    samples_b = bootstrap_metrics(y_true, *b, counts, n_jobs)
+
+    deltas = {name: samples_b[name] - samples_a[name] for name in METRICS}
+    summary = confidence_intervals(deltas, alpha).rename(columns=lambda c: f"Delta {c}")
+
+    # Two-sided bootstrap p-value for a zero difference
+    summary["p"] = [
+        min(1.0, 2 * min(np.nanmean(deltas[name] <= 0), np.nanmean(deltas[name] >= 0)))
+        for name in summary.index
+    ]
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the model on the test split.")
+    parser.add_argument("--bootstrap", type=int, default=0, help="number of bootstrap resamples")
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--jobs", type=int, default=1, help="processes for bootstrap ROC AUC")
+    parser.add_argument("--save-scores", type=Path, help="save test scores to an .npz file")
+    parser.add_argument("--compare", type=Path, help="paired bootstrap against saved scores")
+    args = parser.parse_args()
+
+    y_true, y_score, thresholds, label_names = predict_test_scores()
+    metrics, report = compute_metrics(y_true, y_score, thresholds, label_names)
 
     print("=" * 60)
     print("Test Metrics")
@@ -116,3 +272,32 @@ if __name__ == "__main__":
 
     print("\nClassification Report:")
     print(report_df)
+
+    if args.save_scores:
+        np.savez(args.save_scores, y_true=y_true, y_score=y_score, thresholds=thresholds)
+
+    if args.bootstrap:
+        counts = resample_counts(len(y_true), args.bootstrap)
+        samples = bootstrap_metrics(y_true, y_score, thresholds, counts, args.jobs)
+        print(f"\nBootstrap ({args.bootstrap} resamples, {1 - args.alpha:.0%} CI):")
+        print(confidence_intervals(samples, args.alpha).round(3))
+
+    if args.compare:
+        other = np.load(args.compare)
+        if not np.array_equal(other["y_true"], y_true):
+            raise ValueError(f"{args.compare} was not scored on the same test set")
+
+        summary = paired_bootstrap(
+            y_true,
+            (other["y_score"], other["thresholds"]),
+            (y_score, thresholds),
+            n_resamples=args.bootstrap or 2000,
+            alpha=args.alpha,
+            n_jobs=args.jobs,
+        )
+        print(f"\nPaired bootstrap (this model - {args.compare.name}):")
+        print(summary.round(3))
+
+
+if __name__ == "__main__":
+    main()
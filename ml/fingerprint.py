@@ -0,0 +1,82 @@
+import hashlib
+import re
+from pathlib import Path
+
+from ml.config import load_config
+
+cfg = load_config()
+
+# Everything save_pretrained writes that affects the logits: weights, head, encoder and
+# pooling config, and tokenizer. checkpoint-*/ subdirs are never listed, so they're ignored.
+MODEL_FILES = (
+    "model.safetensors",
+    "model_head.pkl",
+    "config.json",
+    "config_setfit.json",
+    "modules.json",
+    "sentence_bert_config.json",
+    "1_Pooling/config.json",
+    "tokenizer.json",
+    "tokenizer_config.json",
+    "special_tokens_map.json",
+    "vocab.txt",
+)
+
+
+def text_hash(text: str) -> str:
+    """Hashes the exact text of a journal entry."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def normalize_text(text: str) -> str:
+    """Collapses runs of whitespace, which the tokenizer and sentence splitting treat alike.
+
+    No Unicode normalization: NFKC turns "…" into "...", which segments differently.
+    """
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def normalized_text_hash(text: str) -> str:
+    return text_hash(normalize_text(text))
+
+
+def file_digest(path: Path) -> str:
+    """Hashes the contents of a file in fixed-size blocks."""
+    digest = hashlib.sha256()
+    with Path(path).open("rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def files_signature(paths: tuple[Path, ...]) -> str:
+    """Cheap change detector for a set of files, from their modification times and sizes."""
+    digest = hashlib.sha256()
+    for path in paths:
+        if path.exists():
+            stat = path.stat()
+            digest.update(f"{path}:{stat.st_mtime_ns}:{stat.st_size}".encode())
+    return digest.hexdigest()[:16]
+
+
+def model_fingerprint(
+    model_dir: Path,
+    tau: float = cfg.inference.tau,
+    files: tuple[str, ...] = MODEL_FILES,
+) -> str:
+    """Fingerprints the saved-model files of a model directory together with the pooling temperature.
+
+    Only the named `files` (relative to `model_dir`) are hashed, so training checkpoints
+    and calibration files (thresholds/temperatures) don't change the fingerprint;
+    recalibrating a model or cleaning up checkpoints keeps its stored logits valid.
+    """
+    model_dir = Path(model_dir)
+    paths = [model_dir / name for name in files if (model_dir / name).is_file()]
+    if not paths:
+        raise FileNotFoundError(f"No model files found in {model_dir}")
+
+    digest = hashlib.sha256(f"tau={tau}".encode())
+    for path in paths:
+        digest.update(str(path.relative_to(model_dir)).encode())
+        digest.update(file_digest(path).encode())
+    return digest.hexdigest()[:16]
@@ -1,3 +1,13 @@
+import copy
+import hashlib
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
 import nltk
 import numpy as np
 import scipy.special
@@ -5,6 +15,7 @@ from sklearn.metrics import f1_score
 import torch
 
 from setfit import SetFitHead, SetFitModel
+from ml.cache import PredictionCache
 from ml.config import load_config
 from scipy.optimize import minimize
 from sklearn.metrics import log_loss
@@ -63,6 +74,7 @@ def predict_document_logits(
     model: SetFitModel,
     texts: list[str],
     tau: float = cfg.inference.tau,
+    device: str = DEVICE,
 ) -> np.ndarray:
     """Predicts the logits for each document by segmenting it into overlapping chunks and pooling the logits."""
     outputs = []
@@ -76,7 +88,7 @@ def predict_document_logits(
         embeddings = model.model_body.encode(
             chunks,
             convert_to_tensor=True,
-            device=DEVICE,
+            device=device,
         ).clone()
 
         with torch.no_grad():
@@ -92,22 +104,212 @@ def predict_document_logits(
     return np.asarray(outputs)
 
 
+@dataclass
+class StageStats:
+    """Busy time and item count for one stage of the inference pipeline."""
+
+    name: str
+    items: int = 0
+    seconds: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        return self.items / self.seconds if self.seconds else 0.0
+
+
+PIPELINE_STAGES = ("segment", "tokenize", "forward", "pool")
+
+
+def print_stage_stats(stats: dict[str, StageStats], wall_seconds: float | None = None):
+    print(f"{'Stage':<10}{'Docs':>8}{'Busy (s)':>12}{'Docs/s':>12}")
+    for stage in stats.values():
+        print(f"{stage.name:<10}{stage.items:>8}{stage.seconds:>12.3f}{stage.throughput:>12.1f}")
+    if wall_seconds is not None:
+        docs = max(stage.items for stage in stats.values())
+        print(f"{'wall':<10}{docs:>8}{wall_seconds:>12.3f}{docs / wall_seconds:>12.1f}")
+
+
+def predict_document_logits_pipelined(
+    model: SetFitModel,
+    texts: list[str],
+    tau: float = cfg.inference.tau,
+    batch_size: int = cfg.inference.pipeline.batch_size,
+    prefetch: int = cfg.inference.pipeline.prefetch,
+    workers: int = cfg.inference.pipeline.workers,
+    stats: dict[str, StageStats] | None = None,
+    device: str = DEVICE,
+) -> np.ndarray:
+    """Predicts document logits like predict_document_logits, overlapping the CPU-bound stages with the model.
+
+    Worker threads segment and tokenize up to `prefetch` batches ahead of the
+    forward pass, and pooling runs on its own thread behind it. Per-stage busy
+    time is accumulated into `stats` when given.
+    """
+    # for pylance
+    assert model.model_body is not None
+    assert isinstance(model.model_head, SetFitHead)
+
+    body = model.model_body
+    head = model.model_head
+    # The body is called directly rather than through encode(), so do what encode() does:
+    # move to the device and set inference mode
+    body.to(device).eval()
+    head.to(device).eval()
+    stats = stats if stats is not None else {}
+    for name in PIPELINE_STAGES:
+        stats.setdefault(name, StageStats(name))
+
+    # Fast tokenizers are not safe to call concurrently, so each worker gets its own copy
+    local = threading.local()
+
+    def prepare(batch: list[str]):
+        start = time.perf_counter()
+        chunked = [segment_sentences(text) or [text] for text in batch]
+        segmented = time.perf_counter()
+
+        if not hasattr(local, "tokenizer"):
+            local.tokenizer = copy.deepcopy(body.tokenizer)
+        features = local.tokenizer(
+            [chunk for chunks in chunked for chunk in chunks],
+            padding=True,
+            truncation=True,
+            max_length=body.max_seq_length,
+            return_tensors="pt",
+        )
+        end = time.perf_counter()
+
+        sizes = [len(chunks) for chunks in chunked]
+        return sizes, features, segmented - start, end - segmented
+
+    def pool(sizes: list[int], logits: np.ndarray):
+        start = time.perf_counter()
+        bounds = np.cumsum(sizes)[:-1]
+        pooled = [lse_pool(part, tau=tau) for part in np.split(logits, bounds)]
+        return pooled, time.perf_counter() - start
+
+    batches = [texts[i : i + batch_size] for i in range(0, len(texts), batch_size)]
+    outputs = []
+
+    with (
+        ThreadPoolExecutor(max_workers=workers) as prepare_pool,
+        ThreadPoolExecutor(max_workers=1) as pool_pool,
+    ):
+        prepared = deque()
+        pooled = deque()
+        next_batch = 0
+
+        def collect(future):
+            result, seconds = future.result()
+            stats["pool"].items += len(result)
+            stats["pool"].seconds += seconds
+            outputs.extend(result)
+
+        while next_batch < len(batches) or prepared:
+            # Keep at most `prefetch` batches segmented/tokenized ahead of the model
+            while next_batch < len(batches) and len(prepared) < max(prefetch, 1):
+                prepared.append(prepare_pool.submit(prepare, batches[next_batch]))
+                next_batch += 1
+
+            sizes, features, segment_seconds, tokenize_seconds = prepared.popleft().result()
+            stats["segment"].items += len(sizes)
+            stats["segment"].seconds += segment_seconds
+            stats["tokenize"].items += len(sizes)
+            stats["tokenize"].seconds += tokenize_seconds
+
+            start = time.perf_counter()
+            with torch.inference_mode():
+                features = {k: v.to(device) for k, v in features.items()}
+                embeddings = body(features)["sentence_embedding"]
+                logits, _ = head(embeddings)
+                logits = logits.cpu().numpy()
+            stats["forward"].items += len(sizes)
+            stats["forward"].seconds += time.perf_counter() - start
+
+            pooled.append(pool_pool.submit(pool, sizes, logits))
+            while len(pooled) > max(prefetch, 1):
+                collect(pooled.popleft())
+
+        while pooled:
+            collect(pooled.popleft())
+
+    return np.asarray(outputs)
+
+
 def predict_document_proba(
     model: SetFitModel,
     texts: list[str],
     tau: float = cfg.inference.tau,
     temperatures: np.ndarray | None = None,
+    pipelined: bool = False,
+    cache: PredictionCache | None = None,
+    fingerprint: str | None = None,
 ) -> np.ndarray:
-    """Predicts the probabilities for each document by segmenting it into overlapping chunks, pooling the logits, and applying temperature scaling."""
-    logits = predict_document_logits(
-        model,
-        texts,
-        tau=tau,
+    """Predicts the probabilities for each document by segmenting it into overlapping chunks, pooling the logits, and applying temperature scaling.
+
+    With a cache, only documents without cached probabilities for `fingerprint`
+    (see ml.fingerprint.model_fingerprint) are run through the model.
+    """
+    predict = predict_document_logits_pipelined if pipelined else predict_document_logits
+
+    def run(batch: list[str]) -> np.ndarray:
+        logits = predict(
+            model,
+            batch,
+            tau=tau,
+        )
+        if temperatures is not None:
+            logits = logits / temperatures
+
+        return scipy.special.expit(logits)
+
+    if cache is None:
+        return run(texts)
+
+    if fingerprint is None:
+        raise ValueError("A model fingerprint is required when using a cache")
+
+    temperature_key = (
+        "none"
+        if temperatures is None
+        else hashlib.sha256(np.asarray(temperatures, dtype=float).tobytes()).hexdigest()[:16]
+    )
+    model_key = f"{fingerprint}:{tau}:{temperature_key}"
+
+    cached = [cache.get(text, model_key) for text in texts]
+    missing = list(dict.fromkeys(text for text, probs in zip(texts, cached) if probs is None))
+
+    computed = {}
+    if missing:
+        for text, probs in zip(missing, run(missing)):
+            cache.put(text, model_key, probs)
+            computed[text] = probs
+
+    return np.asarray(
+        [probs if probs is not None else computed[text] for text, probs in zip(texts, cached)]
     )
-    if temperatures is not None:
-        logits = logits / temperatures
 
-    return scipy.special.expit(logits)
+
+def load_calibration(
+    label_names: list[str],
+    threshold_path: Path = cfg.evaluation.threshold_file,
+    temperature_path: Path = cfg.evaluation.temperature_file,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Loads the per-label thresholds and temperatures written by validation."""
+    with Path(threshold_path).open() as f:
+        threshold_dict = json.load(f)
+
+    with Path(temperature_path).open() as f:
+        temperature_dict = json.load(f)
+
+    thresholds = np.asarray(
+        [threshold_dict[label] for label in label_names],
+        dtype=float,
+    )
+    temperatures = np.asarray(
+        [temperature_dict[label] for label in label_names],
+        dtype=float,
+    )
+    return thresholds, temperatures
 
 
 def optimize_thresholds(
@@ -138,3 +340,20 @@ def optimize_thresholds(
 
         thresholds[i] = best_t
     return thresholds
+
+
+if __name__ == "__main__":
+    from ml.data import load_journaling_dataset
+
+    dataset, _, _, _ = load_journaling_dataset()
+    model = SetFitModel.from_pretrained(cfg.training.output_dir, device=DEVICE)
+    texts = list(dataset["test"]["text"])
+
+    start = time.perf_counter()
+    predict_document_logits(model, texts)
+    print(f"Sequential: {len(texts) / (time.perf_counter() - start):.1f} docs/s\n")
+
+    stats = {}
+    start = time.perf_counter()
+    predict_document_logits_pipelined(model, texts, stats=stats)
+    print_stage_stats(stats, time.perf_counter() - start)
@@ -1,7 +1,12 @@
 from pathlib import Path
+import hashlib
+import mmap
 import onnx
+import onnxruntime as ort
 import shutil
+import tempfile
 
+from onnx.external_data_helper import set_external_data
 from onnxsim import simplify
 
 from optimum.onnxruntime import ORTQuantizer
@@ -23,20 +28,64 @@ def simplify_onnx(input_onnx: Path, output_onnx: Path):
     onnx.save(model_simp, str(output_onnx))
 
 
-def main():
+def export_shared_model(input_onnx: Path, output_onnx: Path, size_threshold: int = 1024):
+    """Pre-optimize an ONNX model and move its weights into one page-aligned external data file.
+
+    Aligned external initializers are memory-mapped read-only by ONNX Runtime, so
+    every server process that loads the model shares the same physical pages.
+    Graph optimization is done here once so that serving sessions can skip it and
+    never rewrite the weights into private memory. A digest of the external weights
+    is stored in the model metadata, so fingerprinting the small .onnx file alone
+    still detects new weights.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        optimized_onnx = Path(tmp) / "optimized.onnx"
+        options = ort.SessionOptions()
+        # Extended is the highest level that stays hardware-independent
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+        options.optimized_model_filepath = str(optimized_onnx)
+        ort.InferenceSession(str(input_onnx), options, providers=["CPUExecutionProvider"])
+        model = onnx.load(str(optimized_onnx))
+
+    location = f"{output_onnx.name}.data"
+    digest = hashlib.sha256()
+    with (output_onnx.parent / location).open("wb") as f:
+        for tensor in model.graph.initializer:
+            if not tensor.HasField("raw_data") or len(tensor.raw_data) < size_threshold:
+                continue
+
+            # Pad to the mapping granularity so each tensor can be mapped in place
+            f.write(b"\0" * (-f.tell() % mmap.ALLOCATIONGRANULARITY))
+            offset = f.tell()
+            f.write(tensor.raw_data)
+            digest.update(tensor.raw_data)
+
+            set_external_data(tensor, location, offset, len(tensor.raw_data))
+            tensor.ClearField("raw_data")
+            tensor.data_location = onnx.TensorProto.EXTERNAL
+
+    props = {prop.key: prop.value for prop in model.metadata_props}
+    onnx.helper.set_model_props(model, {**props, "weights_sha256": digest.hexdigest()})
+    onnx.save(model, str(output_onnx))
+
+
+def export_model(
+    model_dir: Path = cfg.training.output_dir,
+    output_dir: Path = cfg.export.output_dir,
+) -> Path:
+    """Export a trained SetFit model to a simplified, quantized ONNX model and return its path."""
     shutil.copytree(
-        cfg.training.output_dir,
-        cfg.export.output_dir,
+        model_dir,
+        output_dir,
         dirs_exist_ok=True,
     )
 
-    output_dir = cfg.export.output_dir
     onnx_dir = output_dir / "onnx"
     onnx_dir.mkdir(parents=True, exist_ok=True)
 
     # Load model and tokenizer
     model = SetFitModel.from_pretrained(
-        cfg.export.output_dir, device="cpu", use_differentiable_head=True
+        output_dir, device="cpu", use_differentiable_head=True
     )
 
     # Export and simplify
@@ -83,6 +132,15 @@ def main():
         size_mb = quantized_file.stat().st_size / (1024 * 1024)
         print(f"Quantized ONNX: {quantized_file} ({size_mb:.1f} MB)")
 
+        # Server-side copy with memory-mappable weights (not fetched by the web app)
+        export_shared_model(quantized_file, onnx_dir / "model_shared.onnx")
+
+    return quantized_file
+
+
+def main():
+    export_model()
+
 
 if __name__ == "__main__":
     main()
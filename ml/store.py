@@ -0,0 +1,226 @@
+import argparse
+import sqlite3
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import scipy.special
+import torch
+
+from setfit import SetFitModel
+
+from ml.config import load_config
+from ml.fingerprint import model_fingerprint, text_hash
+from ml.inference import (
+    load_calibration,
+    predict_document_logits,
+    segment_sentences,
+)
+
+cfg = load_config()
+
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
+
+class PredictionStore:
+    """Persistent store of pooled document logits keyed by (text hash, model fingerprint).
+
+    Logits are stored before temperature scaling, so threshold and temperature
+    changes can be applied to stored rows without running the model.
+    """
+
+    def __init__(self, path: Path = cfg.store.path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS logits (
+                text_hash TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                logits BLOB NOT NULL,
+                PRIMARY KEY (text_hash, fingerprint)
+            )
+            """
+        )
+        self.conn.commit()
+
+    def get_many(self, hashes: list[str], fingerprint: str) -> dict[str, np.ndarray]:
+        """Returns the stored logits for the given text hashes under a model fingerprint."""
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        # Stay below SQLite's host parameter limit
+        for start in range(0, len(unique), 500):
+            batch = unique[start : start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = self.conn.execute(
+                f"SELECT text_hash, logits FROM logits "
+                f"WHERE fingerprint = ? AND text_hash IN ({placeholders})",
+                [fingerprint, *batch],
+            )
+            for h, blob in rows:
+                found[h] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, hashes: list[str], fingerprint: str, logits: np.ndarray):
+        """Stores pooled logits for the given text hashes under a model fingerprint."""
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO logits (text_hash, fingerprint, logits) VALUES (?, ?, ?)",
+            [
+                (h, fingerprint, np.asarray(row, dtype=np.float32).tobytes())
+                for h, row in zip(hashes, logits)
+            ],
+        )
+        self.conn.commit()
+
+    def known_hashes(self, hashes: list[str]) -> set[str]:
+        """Returns the text hashes that have logits under any model fingerprint."""
+        known = set()
+        unique = list(dict.fromkeys(hashes))
+        for start in range(0, len(unique), 500):
+            batch = unique[start : start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = self.conn.execute(
+                f"SELECT DISTINCT text_hash FROM logits WHERE text_hash IN ({placeholders})",
+                batch,
+            )
+            known.update(h for (h,) in rows)
+        return known
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+@dataclass
+class RescorePlan:
+    """Summary of the work required to score a corpus under a model fingerprint."""
+
+    fingerprint: str
+    total: int
+    unique: int
+    recalibrate_only: int
+    new_text: int
+    model_changed: int
+    chunks_to_encode: int
+    to_encode: list[str]
+
+    @property
+    def encode_fraction(self) -> float:
+        return (self.new_text + self.model_changed) / self.unique if self.unique else 0.0
+
+
+def plan_rescoring(
+    store: PredictionStore,
+    texts: list[str],
+    fingerprint: str,
+) -> RescorePlan:
+    """Splits a corpus into entries that only need recalibration and entries that must be re-encoded."""
+    unique = dict.fromkeys(text_hash(text) for text in texts)
+    text_by_hash = {text_hash(text): text for text in texts}
+
+    cached = store.get_many(list(unique), fingerprint)
+    missing = [h for h in unique if h not in cached]
+    seen_before = store.known_hashes(missing)
+
+    to_encode = [text_by_hash[h] for h in missing]
+    chunks = sum(len(segment_sentences(text)) or 1 for text in to_encode)
+
+    return RescorePlan(
+        fingerprint=fingerprint,
+        total=len(texts),
+        unique=len(unique),
+        recalibrate_only=len(cached),
+        new_text=len(missing) - len(seen_before),
+        model_changed=len(seen_before),
+        chunks_to_encode=chunks,
+        to_encode=to_encode,
+    )
+
+
+def score_documents(
+    model: SetFitModel,
+    texts: list[str],
+    store: PredictionStore,
+    fingerprint: str,
+    temperatures: np.ndarray | None = None,
+) -> np.ndarray:
+    """Predicts calibrated probabilities, encoding only texts without stored logits for the fingerprint."""
+    if not texts:
+        return np.empty((0, len(cfg.model.labels)))
+
+    plan = plan_rescoring(store, texts, fingerprint)
+
+    if plan.to_encode:
+        logits = predict_document_logits(model, plan.to_encode)
+        store.put_many(
+            [text_hash(text) for text in plan.to_encode],
+            fingerprint,
+            logits,
+        )
+
+    hashes = [text_hash(text) for text in texts]
+    stored = store.get_many(hashes, fingerprint)
+    logits = np.stack([stored[h] for h in hashes]).astype(float)
+
+    if temperatures is not None:
+        logits = logits / temperatures
+
+    return scipy.special.expit(logits)
+
+
+def print_plan(plan: RescorePlan):
+    print("=" * 60)
+    print(f"Rescoring plan for model {plan.fingerprint}")
+    print("=" * 60)
+    print(f"Entries:              {plan.total} ({plan.unique} unique)")
+    print(f"Recalibrate only:     {plan.recalibrate_only}")
+    print(f"Encode (new text):    {plan.new_text}")
+    print(f"Encode (model moved): {plan.model_changed}")
+    print(f"Chunks to encode:     {plan.chunks_to_encode}")
+    print(f"Encode fraction:      {plan.encode_fraction:.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plan or run selective rescoring of a corpus.")
+    parser.add_argument("command", choices=["plan", "score"])
+    parser.add_argument("--input", type=Path, default=cfg.dataset.test)
+    parser.add_argument("--column", default="Answer")
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args()
+
+    texts = pd.read_csv(args.input)[args.column].fillna("").astype(str).tolist()
+    fingerprint = model_fingerprint(cfg.training.output_dir)
+
+    with PredictionStore() as store:
+        plan = plan_rescoring(store, texts, fingerprint)
+        print_plan(plan)
+
+        if args.command == "plan":
+            return
+
+        model = SetFitModel.from_pretrained(
+            cfg.training.output_dir,
+            device=DEVICE,
+        )
+        thresholds, temperatures = load_calibration(cfg.model.labels)
+
+        probs = score_documents(model, texts, store, fingerprint, temperatures)
+
+    if args.output:
+        df = pd.DataFrame(probs, columns=cfg.model.labels)
+        df.insert(0, "text", texts)
+        for i, label in enumerate(cfg.model.labels):
+            df[f"{label}_pred"] = (probs[:, i] >= thresholds[i]).astype(int)
+        df.to_csv(args.output, index=False)
+        print(f"Wrote {len(df)} rows to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
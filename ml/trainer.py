@@ -1,8 +1,12 @@
+import contextlib
+import os
 import random
+import time
+from dataclasses import dataclass
 import numpy as np
 import torch
 
-from ml.config import load_config
+from ml.config import CpuTrainingConfig, TrainingConfig, load_config
 from setfit import SetFitModel, Trainer, TrainingArguments
 from ml.data import load_journaling_dataset
 
@@ -14,34 +18,229 @@ np.random.seed(cfg.project.seed)
 torch.manual_seed(cfg.project.seed)
 torch.cuda.manual_seed_all(cfg.project.seed)
 
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
+
+class CachedTokenizer:
+    """Tokenizer proxy that tokenizes each distinct text once and reuses it every epoch.
+
+    Handles the two call patterns used during SetFit training: batches of texts padded
+    to the longest (contrastive pairs) and single texts (head dataset). Anything else is
+    passed through to the wrapped tokenizer.
+    """
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.encodings: dict[tuple, dict] = {}
+        self.items: dict[tuple, object] = {}
+
+    def __getattr__(self, name):
+        # copy/pickle probe dunders on an instance with no __dict__ yet; forwarding
+        # "tokenizer" then would recurse forever
+        if name == "tokenizer" or name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self.tokenizer, name)
+
+    def prime(self, texts: list[str], max_length: int):
+        """Pre-tokenizes texts in one batched call."""
+        texts = list(dict.fromkeys(texts))
+        encoded = self.tokenizer(texts, truncation=True, max_length=max_length)
+        for i, text in enumerate(texts):
+            self.encodings[(text, max_length)] = {k: v[i] for k, v in encoded.items()}
+
+    def encode(self, text: str, max_length: int) -> dict:
+        key = (text, max_length)
+        if key not in self.encodings:
+            self.encodings[key] = dict(self.tokenizer(text, truncation=True, max_length=max_length))
+        return self.encodings[key]
+
+    def __call__(self, text, *args, **kwargs):
+        if args or not kwargs.get("truncation"):
+            return self.tokenizer(text, *args, **kwargs)
+
+        if isinstance(text, str):
+            key = (text, tuple(sorted((k, repr(v)) for k, v in kwargs.items())))
+            if key not in self.items:
+                self.items[key] = self.tokenizer(text, **kwargs)
+            return self.items[key]
+
+        if (
+            isinstance(text, list)
+            and all(isinstance(t, str) for t in text)
+            and kwargs.get("padding") in (True, "longest")
+        ):
+            max_length = kwargs.get("max_length")
+            return self.tokenizer.pad(
+                [self.encode(t, max_length) for t in text],
+                padding=True,
+                return_tensors=kwargs.get("return_tensors"),
+            )
+
+        return self.tokenizer(text, **kwargs)
+
+
+@dataclass
+class PhaseStats:
+    """Samples processed and time spent in one training phase."""
+
+    name: str
+    samples: int = 0
+    seconds: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        return self.samples / self.seconds if self.seconds else 0.0
+
+
+class PhaseTimingTrainer(Trainer):
+    """Trainer that logs samples/sec for the body contrastive and head phases."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.phase_stats = {name: PhaseStats(name) for name in ("body", "head")}
+
+    def record(self, phase: str, samples: int, seconds: float):
+        stats = self.phase_stats[phase]
+        stats.samples += samples
+        stats.seconds += seconds
+        print(
+            f"[{phase}] {samples} samples in {seconds:.1f}s "
+            f"({samples / seconds if seconds else 0.0:.1f} samples/s)"
+        )
+
+    def train_embeddings(self, x_train, y_train=None, x_eval=None, y_eval=None, args=None):
+        start = time.perf_counter()
+        super().train_embeddings(x_train, y_train, x_eval, y_eval, args=args)
+        args = args or self.args
+        pairs = len(self.st_trainer.train_dataset)
+        self.record("body", pairs * args.embedding_num_epochs, time.perf_counter() - start)
+
+    def train_classifier(self, x_train, y_train, args=None):
+        start = time.perf_counter()
+        super().train_classifier(x_train, y_train, args=args)
+        args = args or self.args
+        self.record("head", len(x_train) * args.classifier_num_epochs, time.perf_counter() - start)
+
+
+def bf16_supported() -> bool:
+    """Whether the CPU has native bfloat16 support (AVX512-BF16 or AMX)."""
+    checks = ("_is_avx512_bf16_supported", "_is_amx_tile_supported")
+    return any(getattr(torch.cpu, check, lambda: False)() for check in checks)
+
+
+def available_cores(cpu: CpuTrainingConfig = cfg.training.cpu) -> list[int]:
+    """The cores training may use: the configured affinity, else all cores this process may run on."""
+    if cpu.affinity:
+        return list(cpu.affinity)
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def split_cores(cpu: CpuTrainingConfig, index: int, n_workers: int) -> CpuTrainingConfig:
+    """Gives worker `index` of `n_workers` its own slice of the cores, so workers don't oversubscribe."""
+    cores = available_cores(cpu)
+    per_worker = max(1, len(cores) // n_workers)
+    start = (index * per_worker) % len(cores)
+    return cpu.model_copy(
+        update={"affinity": cores[start : start + per_worker], "num_threads": per_worker}
+    )
+
+
+def configure_cpu_threads(cpu: CpuTrainingConfig = cfg.training.cpu):
+    """Pins the process to the configured cores and sizes torch's thread pools to match."""
+    if cpu.affinity and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpu.affinity)
+
+    num_threads = cpu.num_threads
+    if num_threads is None and hasattr(os, "sched_getaffinity"):
+        num_threads = len(os.sched_getaffinity(0))
+    if num_threads:
+        torch.set_num_threads(num_threads)
+
+    if cpu.interop_threads:
+        try:
+            torch.set_num_interop_threads(cpu.interop_threads)
+        except RuntimeError:
+            # Can only be set before any inter-op work has started
+            pass
+
+
+def apply_cpu_profile(model: SetFitModel, training: TrainingConfig = cfg.training):
+    """Applies the CPU training profile to a freshly built model."""
+    assert model.model_body is not None
+
+    configure_cpu_threads(training.cpu)
+
+    if training.cpu.cache_tokenization:
+        try:
+            model.model_body.tokenizer = CachedTokenizer(model.model_body.tokenizer)
+        except AttributeError:
+            # Newer sentence-transformers expose the tokenizer read-only; train uncached
+            print("Tokenizer can't be replaced on this model; tokenization caching disabled")
+
+    if training.cpu.compile:
+        transformer = model.model_body[0]
+        transformer.auto_model = torch.compile(transformer.auto_model)
+
+
+def unwrap_compiled(model: SetFitModel):
+    """Restores the original encoder (and tokenizer) so the model saves normally."""
+    assert model.model_body is not None
+
+    transformer = model.model_body[0]
+    transformer.auto_model = getattr(transformer.auto_model, "_orig_mod", transformer.auto_model)
+    if isinstance(model.model_body.tokenizer, CachedTokenizer):
+        model.model_body.tokenizer = model.model_body.tokenizer.tokenizer
 
-def train_model():
-    dataset, label_names, _, _ = load_journaling_dataset()
 
-    device = "cuda" if torch.cuda.is_available() else "cpu"
+def training_autocast(training: TrainingConfig = cfg.training):
+    """bfloat16 autocast for CPU training where supported, otherwise a no-op."""
+    if DEVICE == "cpu" and training.cpu.bf16 and bf16_supported():
+        return torch.autocast("cpu", dtype=torch.bfloat16)
+    return contextlib.nullcontext()
+
+
+def build_model(label_names: list[str], training: TrainingConfig = cfg.training) -> SetFitModel:
     model = SetFitModel.from_pretrained(
         cfg.model.base,
         multi_target_strategy="one-vs-rest",
-        device=device,
+        device=DEVICE,
         use_differentiable_head=True,
         head_params={"out_features": len(label_names)},
     )
 
-    args = TrainingArguments(
-        output_dir=str(cfg.training.output_dir),
-        batch_size=(cfg.training.batch_size.embedding, cfg.training.batch_size.classifier),
-        num_epochs=(cfg.training.epochs.embedding, cfg.training.epochs.classifier),
-        body_learning_rate=cfg.training.body_learning_rate,
-        head_learning_rate=cfg.training.head_learning_rate,
-        l2_weight=cfg.training.l2_weight,
-        sampling_strategy=cfg.training.sampling_strategy,
+    if DEVICE == "cpu":
+        apply_cpu_profile(model, training)
+
+    return model
+
+
+def build_training_args(training: TrainingConfig = cfg.training) -> TrainingArguments:
+    return TrainingArguments(
+        output_dir=str(training.output_dir),
+        batch_size=(training.batch_size.embedding, training.batch_size.classifier),
+        num_epochs=(training.epochs.embedding, training.epochs.classifier),
+        body_learning_rate=training.body_learning_rate,
+        head_learning_rate=training.head_learning_rate,
+        l2_weight=training.l2_weight,
+        sampling_strategy=training.sampling_strategy,
         end_to_end=True,
         use_amp=torch.cuda.is_available(),
         seed=cfg.project.seed,
-        max_length=cfg.training.max_length,
+        max_length=training.max_length,
     )
 
-    trainer = Trainer(
+
+def build_trainer(model: SetFitModel, dataset, args: TrainingArguments) -> Trainer:
+    assert model.model_body is not None
+
+    tokenizer = model.model_body.tokenizer
+    if isinstance(tokenizer, CachedTokenizer):
+        texts = list(dataset["train"]["text"]) + list(dataset["validation"]["text"])
+        tokenizer.prime(texts, model.model_body.max_seq_length)
+
+    return PhaseTimingTrainer(
         model=model,
         train_dataset=dataset["train"],
         eval_dataset=dataset["validation"],
@@ -52,7 +251,17 @@ def train_model():
         args=args,
     )
 
-    trainer.train(resume_from_checkpoint=False)
+
+def train_model():
+    dataset, label_names, _, _ = load_journaling_dataset()
+
+    model = build_model(label_names)
+    trainer = build_trainer(model, dataset, build_training_args())
+
+    with training_autocast():
+        trainer.train(resume_from_checkpoint=False)
+
+    unwrap_compiled(model)
     trainer.model.save_pretrained(cfg.training.output_dir)
 
 
@@ -0,0 +1,261 @@
+import argparse
+import functools
+import multiprocessing
+from typing import Callable
+
+import numpy as np
+import optuna
+import torch
+import yaml
+
+from optuna.storages import RDBStorage, RetryFailedTrialCallback
+from optuna.study import MaxTrialsCallback
+from optuna.trial import TrialState
+from setfit import SetFitHead, SetFitModel, TrainingArguments
+from sklearn.metrics import f1_score
+
+from ml.config import OVERLAY_PATH, CpuTrainingConfig, TrainingConfig, load_config
+from ml.data import load_journaling_dataset
+from ml.inference import predict_document_logits
+from ml.trainer import (
+    DEVICE,
+    build_model,
+    build_trainer,
+    build_training_args,
+    split_cores,
+    training_autocast,
+)
+
+cfg = load_config()
+
+
+def get_storage() -> RDBStorage:
+    cfg.tuning.storage.parent.mkdir(parents=True, exist_ok=True)
+    return RDBStorage(
+        f"sqlite:///{cfg.tuning.storage}",
+        # Workers share one SQLite file, so wait on locks rather than failing
+        engine_kwargs={"connect_args": {"timeout": 60}},
+        # Trials of a killed worker are marked failed and re-queued on resume
+        heartbeat_interval=60,
+        grace_period=180,
+        failed_trial_callback=RetryFailedTrialCallback(max_retry=1),
+    )
+
+
+def get_study(seed: int = cfg.project.seed) -> optuna.Study:
+    return optuna.create_study(
+        study_name=cfg.tuning.study_name,
+        storage=get_storage(),
+        direction="maximize",
+        load_if_exists=True,
+        sampler=optuna.samplers.TPESampler(seed=seed, constant_liar=True),
+        pruner=optuna.pruners.MedianPruner(n_startup_trials=5, n_warmup_steps=1),
+    )
+
+
+def suggest_training_config(trial: optuna.Trial) -> TrainingConfig:
+    """Samples a training configuration from the search space."""
+    return cfg.training.model_copy(
+        update={
+            "batch_size": cfg.training.batch_size.model_copy(
+                update={
+                    "embedding": trial.suggest_categorical("embedding_batch_size", [8, 16, 32]),
+                    "classifier": trial.suggest_categorical("classifier_batch_size", [2, 4, 8, 16]),
+                }
+            ),
+            "epochs": cfg.training.epochs.model_copy(
+                update={
+                    "embedding": trial.suggest_int("embedding_epochs", 1, 6),
+                    "classifier": trial.suggest_int(
+                        "classifier_epochs",
+                        cfg.tuning.classifier_step_epochs,
+                        32,
+                        step=cfg.tuning.classifier_step_epochs,
+                    ),
+                }
+            ),
+            "body_learning_rate": trial.suggest_float("body_learning_rate", 1e-6, 1e-4, log=True),
+            "head_learning_rate": trial.suggest_float("head_learning_rate", 1e-3, 1e-1, log=True),
+            "l2_weight": trial.suggest_float("l2_weight", 1e-5, 1e-2, log=True),
+            "sampling_strategy": trial.suggest_categorical(
+                "sampling_strategy", ["oversampling", "undersampling", "unique"]
+            ),
+        }
+    )
+
+
+def validation_f1(model: SetFitModel, texts: list[str], y_true: np.ndarray) -> float:
+    """Document-level validation macro F1 at a fixed 0.5 threshold, comparable across trials."""
+    y_pred = (predict_document_logits(model, texts) >= 0).astype(int)
+    return f1_score(y_true, y_pred, average="macro", zero_division=0)
+
+
+def fit_head(
+    model: SetFitModel,
+    x_train: list[str],
+    y_train: list,
+    args: TrainingArguments,
+    on_epoch: Callable[[int], None],
+):
+    """Trains the differentiable head like SetFitModel.fit, calling `on_epoch` after each epoch.
+
+    Mirrors SetFitModel.fit from the pinned setfit==1.1.3; re-check it when upgrading.
+    One optimizer and StepLR schedule span all epochs, exactly as in a single
+    train_classifier call, so a trial scores the schedule train_model reproduces.
+    """
+    assert model.model_body is not None
+    assert isinstance(model.model_head, SetFitHead)
+
+    if not args.end_to_end:
+        model.freeze("body")
+
+    dataloader = model._prepare_dataloader(
+        list(x_train), list(y_train), args.classifier_batch_size, args.max_length
+    )
+    criterion = model.model_head.get_loss_fn()
+    optimizer = model._prepare_optimizer(
+        args.head_learning_rate, args.body_classifier_learning_rate, args.l2_weight
+    )
+    scheduler = torch.optim.lr_scheduler.StepLR(optimizer, step_size=5, gamma=0.5)
+
+    try:
+        for epoch in range(args.classifier_num_epochs):
+            # on_epoch evaluates, which leaves the model in eval mode
+            model.model_body.train()
+            model.model_head.train()
+
+            for features, labels in dataloader:
+                optimizer.zero_grad()
+                features = {k: v.to(model.device) for k, v in features.items()}
+                outputs = model.model_body(features)
+                if model.normalize_embeddings:
+                    outputs["sentence_embedding"] = torch.nn.functional.normalize(
+                        outputs["sentence_embedding"], p=2, dim=1
+                    )
+                logits = model.model_head(outputs)["logits"]
+
+                loss = criterion(logits, labels.to(model.device))
+                loss.backward()
+                optimizer.step()
+
+            scheduler.step()
+            on_epoch(epoch)
+    finally:
+        if not args.end_to_end:
+            model.unfreeze("body")
+
+
+def objective(trial: optuna.Trial, cpu: CpuTrainingConfig = cfg.training.cpu) -> float:
+    """Trains one configuration and returns its validation macro F1.
+
+    Only the head phase is reported to the pruner: validation F1 needs a trained
+    head, so a trial can't be pruned until its body phase has finished.
+    """
+    dataset, label_names, _, _ = load_journaling_dataset()
+    training = suggest_training_config(trial).model_copy(update={"cpu": cpu})
+
+    model = build_model(label_names, training)
+    args = build_training_args(training)
+    trainer = build_trainer(model, dataset, args)
+
+    x_train, y_train = trainer.dataset_to_parameters(trainer.train_dataset)
+    x_eval, y_eval = trainer.dataset_to_parameters(trainer.eval_dataset)
+    val_texts = list(dataset["validation"]["text"])
+    val_labels = np.asarray(dataset["validation"]["labels"])
+
+    with training_autocast(training):
+        trainer.train_embeddings(x_train, y_train, x_eval, y_eval, args=args)
+
+    # Report validation F1 every few head epochs so weak trials stop early
+    step_epochs = cfg.tuning.classifier_step_epochs
+    scores = []
+
+    def report(epoch: int):
+        if (epoch + 1) % step_epochs and epoch + 1 < args.classifier_num_epochs:
+            return
+        # Score in full precision, like the exported model
+        with torch.autocast(DEVICE, enabled=False):
+            scores.append(validation_f1(model, val_texts, val_labels))
+
+        trial.report(scores[-1], epoch)
+        if trial.should_prune():
+            raise optuna.TrialPruned()
+
+    with training_autocast(training):
+        fit_head(model, x_train, y_train, args, report)
+
+    return scores[-1]
+
+
+def run_worker(n_trials: int, worker_index: int = 0, n_workers: int = 1):
+    # Seeded per worker, or every worker would sample the same startup trials
+    study = get_study(seed=cfg.project.seed + worker_index)
+    cpu = cfg.training.cpu
+    if DEVICE == "cpu":
+        cpu = split_cores(cpu, worker_index, n_workers)
+    study.optimize(
+        functools.partial(objective, cpu=cpu),
+        callbacks=[MaxTrialsCallback(n_trials, states=(TrialState.COMPLETE, TrialState.PRUNED))],
+        gc_after_trial=True,
+    )
+
+
+def best_params_overlay(params: dict) -> dict:
+    """Maps the best trial's parameters onto the config.yaml layout."""
+    return {
+        "training": {
+            "batch_size": {
+                "embedding": params["embedding_batch_size"],
+                "classifier": params["classifier_batch_size"],
+            },
+            "epochs": {
+                "embedding": params["embedding_epochs"],
+                "classifier": params["classifier_epochs"],
+            },
+            "body_learning_rate": params["body_learning_rate"],
+            "head_learning_rate": params["head_learning_rate"],
+            "l2_weight": params["l2_weight"],
+            "sampling_strategy": params["sampling_strategy"],
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run or resume the hyperparameter search.")
+    parser.add_argument("--trials", type=int, default=cfg.tuning.n_trials)
+    parser.add_argument("--workers", type=int, default=cfg.tuning.n_workers)
+    args = parser.parse_args()
+
+    # Create the study once so workers don't race on table creation
+    get_study()
+
+    # Spawn rather than fork so each worker initializes torch/CUDA itself
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(target=run_worker, args=(args.trials, index, args.workers))
+        for index in range(args.workers)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    study = get_study()
+    states = [t.state for t in study.trials]
+    print(
+        f"Trials: {states.count(TrialState.COMPLETE)} complete, "
+        f"{states.count(TrialState.PRUNED)} pruned, {states.count(TrialState.FAIL)} failed"
+    )
+    if TrialState.COMPLETE not in states:
+        print("No trial completed; not writing tuned parameters")
+        return
+
+    print(f"Best validation macro F1: {study.best_value:.3f}")
+
+    with OVERLAY_PATH.open("w") as f:
+        yaml.safe_dump(best_params_overlay(study.best_params), f, sort_keys=False)
+    print(f"Wrote best parameters to {OVERLAY_PATH}")
+
+
+if __name__ == "__main__":
+    main()
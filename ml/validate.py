@@ -1,4 +1,5 @@
 import json
+from pathlib import Path
 
 import numpy as np
 import pandas as pd
@@ -30,11 +31,15 @@ TEMPERATURE_PATH = cfg.evaluation.temperature_file
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 
 
-def validate_model():
+def validate_model(
+    model_dir: Path = cfg.training.output_dir,
+    threshold_path: Path = THRESHOLD_PATH,
+    temperature_path: Path = TEMPERATURE_PATH,
+):
     dataset, label_names, _, _ = load_journaling_dataset()
 
     model = SetFitModel.from_pretrained(
-        cfg.training.output_dir,
+        model_dir,
         device=DEVICE,
     )
 
@@ -57,16 +62,16 @@ def validate_model():
         y_score,
     )
 
-    THRESHOLD_PATH.parent.mkdir(parents=True, exist_ok=True)
-    TEMPERATURE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    threshold_path.parent.mkdir(parents=True, exist_ok=True)
+    temperature_path.parent.mkdir(parents=True, exist_ok=True)
 
-    with THRESHOLD_PATH.open("w") as f:
+    with threshold_path.open("w") as f:
         json.dump(
             dict(zip(label_names, thresholds.tolist())),
             f,
             indent=2,
         )
-    with TEMPERATURE_PATH.open("w") as f:
+    with temperature_path.open("w") as f:
         json.dump(
             dict(zip(label_names, temperatures.tolist())),
             f,
@@ -1,6 +1,18 @@
+import json
+import mmap
+import os
+import threading
+
 from fastapi.testclient import TestClient
+import numpy as np
+import onnxruntime as ort
 import pytest
+from apps.api.latency import make_texts
 from apps.api.main import app
+from apps.api.memory import parse_smaps
+from apps.api.model import EmotionModel, SharedEmotionModel, segment_sentences
+from apps.api.registry import ModelRegistry
+from ml.cache import PredictionCache
 
 client = TestClient(app)
 
@@ -25,3 +37,314 @@ def test_models_static_serving():
 def test_spa_fallback():
     response = client.get("/random/path")
     assert response.status_code in (200, 404)
+
+
+def test_predict_rejects_empty_text():
+    response = client.post("/api/predict", json={"text": ""})
+    assert response.status_code == 422
+
+
+def test_api_segment_sentences_overlapping():
+    assert segment_sentences("Hello world. How are you? I'm fine.") == [
+        "Hello world.",
+        "Hello world. How are you?",
+        "How are you? I'm fine.",
+    ]
+
+
+def test_cache_key_keeps_text_that_segments_differently():
+    ellipsis, dots = "Tired\u2026 Bed.", "Tired... Bed."
+    assert segment_sentences(ellipsis) != segment_sentences(dots)
+    assert PredictionCache.key(ellipsis, "fp") != PredictionCache.key(dots, "fp")
+    assert PredictionCache.key(" Tired...\n Bed. ", "fp") == PredictionCache.key(dots, "fp")
+
+
+def test_parse_smaps_splits_shared_and_model_memory():
+    smaps = """\
+7f00-7f10 r--p 00000000 fe:00 123    /srv/models/v1/onnx/model_shared.onnx.data
+Rss:                 100 kB
+Pss:                  50 kB
+Shared_Clean:        100 kB
+Private_Clean:         0 kB
+7f20-7f30 rw-p 00000000 00:00 0
+Rss:                  40 kB
+Pss:                  40 kB
+Private_Dirty:        40 kB
+VmFlags: rd wr mr mw me ac
+"""
+    memory = parse_smaps(1, smaps)
+
+    assert memory.rss_kb == 140
+    assert memory.pss_kb == 90
+    assert memory.shared_kb == 100
+    assert memory.unique_kb == 40
+    assert memory.model_rss_kb == 100
+    assert memory.model_unique_kb == 0
+
+
+class FakeModel:
+    def __init__(self, model_dir):
+        self.model_dir = model_dir
+        self.model_path = model_dir
+        self.version = model_dir.name
+        self.available = True
+        self.closed = False
+        self.timings = {}
+        self.loaded = threading.Event()
+        self.loaded.set()
+
+    def load(self):
+        self.loaded.wait(timeout=5)
+        if self.version.startswith("broken"):
+            raise OSError("Corrupt model file")
+        self.timings["load_ms"] = 1.0
+
+    def warm_up(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def test_ready_flips_after_load(tmp_path):
+    models = []
+
+    def factory(model_dir):
+        model = FakeModel(model_dir)
+        model.loaded.clear()
+        models.append(model)
+        return model
+
+    registry = ModelRegistry(tmp_path, factory)
+    previous = app.state.registry
+    app.state.registry = registry
+    try:
+        response = client.get("/api/ready")
+        assert response.status_code == 503
+        assert response.json()["status"] == "unavailable"
+
+        thread = registry.reload("v1")
+        response = client.get("/api/ready")
+        assert response.status_code == 503
+        assert response.json()["status"] == "loading"
+
+        models[-1].loaded.set()
+        thread.join()
+
+        response = client.get("/api/ready")
+        assert response.status_code == 200
+        assert response.json()["status"] == "ready"
+        assert response.json()["version"] == "v1"
+        assert response.json()["timings"]["load_ms"] == 1.0
+    finally:
+        app.state.registry = previous
+
+
+def test_registry_swaps_after_in_flight_requests(tmp_path):
+    registry = ModelRegistry(tmp_path, FakeModel)
+    registry.reload("v1").join()
+
+    with registry.acquire() as old:
+        registry.reload("v2").join()
+
+        assert registry.active.version == "v2"
+        assert old.version == "v1"
+        assert not old.closed
+        assert registry.status()["retired"] == ["v1"]
+
+    assert old.closed
+    assert registry.status()["retired"] == []
+
+
+def test_registry_canary_and_promote(tmp_path):
+    registry = ModelRegistry(tmp_path, FakeModel)
+    registry.reload("v1").join()
+    registry.reload("v2", canary_fraction=0.5).join()
+
+    versions = set()
+    for _ in range(200):
+        with registry.acquire() as model:
+            versions.add(model.version)
+    assert versions == {"v1", "v2"}
+
+    registry.promote()
+    assert registry.status()["active"] == "v2"
+    assert registry.status()["canary"] is None
+
+
+def test_registry_rejects_path_versions(tmp_path):
+    registry = ModelRegistry(tmp_path, FakeModel)
+
+    with pytest.raises(ValueError):
+        registry.reload("../v1")
+
+
+def test_model_status():
+    response = client.get("/api/model")
+    assert response.status_code == 200
+    assert "active" in response.json()
+
+
+def test_model_admin_disabled_without_token():
+    response = client.post("/api/model/promote")
+    assert response.status_code == 403
+
+
+def test_model_admin_requires_token(monkeypatch):
+    monkeypatch.setattr("apps.api.main.ADMIN_TOKEN", "secret")
+
+    response = client.post("/api/model/promote", headers={"Authorization": "Bearer wrong"})
+    assert response.status_code == 401
+
+    response = client.post("/api/model/promote", headers={"Authorization": "Bearer secret"})
+    assert response.status_code == 409
+
+
+def test_registry_syncs_workers_through_published_state(tmp_path):
+    state_path = tmp_path / "serving.json"
+    worker = ModelRegistry(tmp_path, FakeModel, state_path)
+    other = ModelRegistry(tmp_path, FakeModel, state_path)
+    worker.load("v1").join()
+    other.load("v1").join()
+    assert other.sync() is None
+
+    worker.reload("v2", canary_fraction=0.25).join()
+    other.sync().join()
+    assert other.status()["canary"] == "v2"
+    assert other.canary_fraction == 0.25
+
+    worker.promote()
+    assert other.sync() is None
+    assert other.status()["active"] == "v2"
+    assert other.status()["canary"] is None
+
+    worker.reload("v3").join()
+    other.sync().join()
+    assert other.status()["active"] == "v3"
+    assert other.status()["published"] == worker.status()["published"]
+
+
+def test_registry_does_not_retry_failed_sync(tmp_path):
+    state_path = tmp_path / "serving.json"
+    worker = ModelRegistry(tmp_path, FakeModel, state_path)
+    worker.load("v1").join()
+
+    state_path.write_text(
+        '{"active": "../v2", "canary": null, "canary_fraction": 0.0, "default_version": null}'
+    )
+    assert worker.sync() is None
+    assert "Invalid model version" in worker.error
+    assert worker.sync() is None
+    assert worker.status()["active"] == "v1"
+
+
+def test_registry_publishes_only_after_successful_load(tmp_path):
+    state_path = tmp_path / "serving.json"
+    worker = ModelRegistry(tmp_path, FakeModel, state_path, "v1")
+    worker.reload("v1").join()
+    assert worker.published_state()["active"] == "v1"
+
+    worker.reload("broken").join()
+    assert worker.error == "Corrupt model file"
+    assert worker.published_state()["active"] == "v1"
+    assert worker.status()["active"] == "v1"
+
+
+def test_registry_falls_back_to_default_version(tmp_path):
+    state_path = tmp_path / "serving.json"
+    state_path.write_text(
+        '{"active": "broken", "canary": null, "canary_fraction": 0.0, "default_version": "v1"}'
+    )
+    worker = ModelRegistry(tmp_path, FakeModel, state_path, "v1")
+
+    worker.sync().join()
+    # The failed load starts the fallback before it exits
+    for thread in threading.enumerate():
+        if thread.name == "load-v1":
+            thread.join()
+    assert worker.status()["active"] == "v1"
+    assert worker.sync() is None
+
+
+def test_registry_ignores_state_from_earlier_deploy(tmp_path):
+    state_path = tmp_path / "serving.json"
+    ModelRegistry(tmp_path, FakeModel, state_path, "v1").reload("v2").join()
+
+    redeployed = ModelRegistry(tmp_path, FakeModel, state_path, "v3")
+    assert redeployed.published_state() is None
+    assert redeployed.sync() is None
+
+
+def test_calibration_refresh_changes_cache_key(tmp_path):
+    (tmp_path / "temperatures.json").write_text(json.dumps({"joy": 1.0, "anger": 2.0}))
+    (tmp_path / "thresholds.json").write_text(json.dumps({"joy": 0.5, "anger": 0.5}))
+    model = EmotionModel(tmp_path)
+    model.load_calibration()
+    before = model.refresh_calibration()
+    assert model.refresh_calibration() is before
+
+    (tmp_path / "temperatures.json").write_text(json.dumps({"joy": 1.5, "anger": 2.0}))
+    os.utime(tmp_path / "temperatures.json", ns=(0, 0))
+    after = model.refresh_calibration()
+
+    assert after.temperatures.tolist() == [1.5, 2.0]
+    assert after.key != before.key
+    assert before.temperatures.tolist() == [1.0, 2.0]
+
+
+def test_latency_benchmark_texts_are_distinct():
+    texts = make_texts(20) + make_texts(20, offset=20)
+
+    assert len(set(texts)) == 40
+    assert len(segment_sentences(texts[7])) == 9
+
+
+def test_export_shared_model_aligns_external_weights(tmp_path):
+    onnx = pytest.importorskip("onnx")
+    # ml.onnx pulls in the ONNX export toolchain
+    export_shared_model = pytest.importorskip("ml.onnx").export_shared_model
+    from onnx import TensorProto, helper, numpy_helper
+
+    rng = np.random.default_rng(0)
+    weights = [rng.standard_normal((32, 32)).astype(np.float32) for _ in range(3)]
+    bias = np.ones(32, dtype=np.float32)  # under the 1 KB threshold, stays inline
+    nodes = [
+        helper.make_node("MatMul", ["x", "w0"], ["h0"]),
+        helper.make_node("MatMul", ["h0", "w1"], ["h1"]),
+        helper.make_node("MatMul", ["h1", "w2"], ["h2"]),
+        helper.make_node("Add", ["h2", "b"], ["y"]),
+    ]
+    graph = helper.make_graph(
+        nodes,
+        "tiny",
+        [helper.make_tensor_value_info("x", TensorProto.FLOAT, [1, 32])],
+        [helper.make_tensor_value_info("y", TensorProto.FLOAT, [1, 32])],
+        initializer=[numpy_helper.from_array(w, f"w{i}") for i, w in enumerate(weights)]
+        + [numpy_helper.from_array(bias, "b")],
+    )
+    source = tmp_path / "model.onnx"
+    onnx.save(
+        helper.make_model(graph, opset_imports=[helper.make_opsetid("", 18)], ir_version=9), source
+    )
+
+    (tmp_path / "onnx").mkdir()
+    shared = tmp_path / "onnx" / "model_shared.onnx"
+    export_shared_model(source, shared)
+
+    model = onnx.load(str(shared), load_external_data=False)
+    external = [t for t in model.graph.initializer if t.data_location == TensorProto.EXTERNAL]
+    assert external
+    for tensor in external:
+        info = {entry.key: entry.value for entry in tensor.external_data}
+        assert int(info["offset"]) % mmap.ALLOCATIONGRANULARITY == 0
+    assert any(prop.key == "weights_sha256" for prop in model.metadata_props)
+
+    session = ort.InferenceSession(
+        str(shared),
+        sess_options=SharedEmotionModel(tmp_path).session_options(),
+        providers=["CPUExecutionProvider"],
+    )
+    x = rng.standard_normal((1, 32)).astype(np.float32)
+    (y,) = session.run(None, {"x": x})
+    np.testing.assert_allclose(y, x @ weights[0] @ weights[1] @ weights[2] + bias, rtol=1e-3, atol=1e-3)
+
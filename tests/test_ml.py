@@ -1,15 +1,30 @@
+import copy
+import pickle
+
 import numpy as np
 import pytest
-from setfit import SetFitModel
+import torch
+from sentence_transformers import SentenceTransformer, models
+from setfit import SetFitHead, SetFitModel, TrainingArguments
+from sklearn.metrics import f1_score, hamming_loss, roc_auc_score
+from transformers import BertConfig, BertModel, BertTokenizerFast
 
 from ml.inference import (
     DEVICE,
     lse_pool,
     optimize_thresholds,
     predict_document_logits,
+    predict_document_logits_pipelined,
     predict_document_proba,
     segment_sentences,
 )
+from ml.cache import PredictionCache
+from ml.config import CpuTrainingConfig, merge_overlay
+from ml.evaluate import bootstrap_metrics, paired_bootstrap, resample_counts
+from ml.fingerprint import model_fingerprint, text_hash
+from ml.store import PredictionStore, plan_rescoring
+from ml.trainer import CachedTokenizer, split_cores
+from ml.tune import fit_head
 
 MODEL_PATH = "artifacts/experiments/journaling_model/v1"
 
@@ -69,6 +84,35 @@ def test_predict_document_logits_shape(model):
     assert logits.shape == (2, 13)
 
 
+def test_predict_document_logits_pipelined_matches_sequential(model):
+    texts = [
+        "I feel great today. Then it rained.",
+        "Everything is terrible.",
+        "Good day.",
+    ]
+
+    # Left in train mode (dropout on), as after training
+    model.model_body.train()
+    model.model_head.train()
+
+    stats = {}
+    pipelined = predict_document_logits_pipelined(
+        model,
+        texts,
+        batch_size=2,
+        prefetch=1,
+        stats=stats,
+        device=DEVICE,
+    )
+
+    np.testing.assert_allclose(
+        pipelined,
+        predict_document_logits(model, texts),
+        atol=1e-5,
+    )
+    assert all(stage.items == len(texts) for stage in stats.values())
+
+
 def test_predict_document_proba_shape(model):
     texts = [
         "Happy.",
@@ -107,3 +151,273 @@ def test_optimize_thresholds_shape():
     assert thresholds.shape == (2,)
     assert np.all(thresholds >= 0.0)
     assert np.all(thresholds <= 1.0)
+
+
+def test_prediction_store_roundtrip(tmp_path):
+    logits = np.random.randn(2, 13).astype(np.float32)
+
+    with PredictionStore(tmp_path / "store.sqlite") as store:
+        store.put_many(["a", "b"], "fp1", logits)
+
+        found = store.get_many(["a", "b", "c"], "fp1")
+
+        assert set(found) == {"a", "b"}
+        np.testing.assert_array_equal(found["a"], logits[0])
+        assert store.get_many(["a"], "fp2") == {}
+        assert store.known_hashes(["a", "c"]) == {"a"}
+
+
+def test_plan_rescoring_splits_work(tmp_path):
+    texts = ["Good day.", "Good day.", "Bad day.", "New entry."]
+
+    with PredictionStore(tmp_path / "store.sqlite") as store:
+        store.put_many([text_hash("Good day.")], "new", np.zeros((1, 13)))
+        store.put_many([text_hash("Bad day.")], "old", np.zeros((1, 13)))
+
+        plan = plan_rescoring(store, texts, "new")
+
+    assert plan.total == 4
+    assert plan.unique == 3
+    assert plan.recalibrate_only == 1
+    assert plan.model_changed == 1
+    assert plan.new_text == 1
+    assert plan.to_encode == ["Bad day.", "New entry."]
+
+
+def test_model_fingerprint_ignores_calibration_and_checkpoints(tmp_path):
+    (tmp_path / "model.safetensors").write_bytes(b"weights")
+    before = model_fingerprint(tmp_path)
+
+    (tmp_path / "thresholds.json").write_text("{}")
+    assert model_fingerprint(tmp_path) == before
+
+    (tmp_path / "checkpoint-10").mkdir()
+    (tmp_path / "checkpoint-10" / "model.safetensors").write_bytes(b"checkpoint")
+    assert model_fingerprint(tmp_path) == before
+
+    (tmp_path / "model.safetensors").write_bytes(b"retrained")
+    assert model_fingerprint(tmp_path) != before
+
+
+def test_model_fingerprint_covers_pooling_and_tokenizer(tmp_path):
+    (tmp_path / "model.safetensors").write_bytes(b"weights")
+    (tmp_path / "1_Pooling").mkdir()
+    (tmp_path / "1_Pooling" / "config.json").write_text('{"pooling_mode_mean_tokens": true}')
+    (tmp_path / "sentence_bert_config.json").write_text('{"max_seq_length": 128}')
+    before = model_fingerprint(tmp_path)
+
+    (tmp_path / "1_Pooling" / "config.json").write_text('{"pooling_mode_cls_token": true}')
+    pooling_changed = model_fingerprint(tmp_path)
+    assert pooling_changed != before
+
+    (tmp_path / "sentence_bert_config.json").write_text('{"max_seq_length": 256}')
+    assert model_fingerprint(tmp_path) != pooling_changed
+
+    (tmp_path / "tokenizer.json").write_text("{}")
+    assert model_fingerprint(tmp_path) != pooling_changed
+
+
+def test_prediction_cache_lru_and_stats(tmp_path):
+    cache = PredictionCache(max_entries=2, disk_path=None)
+
+    cache.put("a", "fp", np.ones(13))
+    cache.put("b", "fp", np.ones(13))
+    assert cache.get("a", "fp") is not None
+    cache.put("c", "fp", np.ones(13))
+
+    assert cache.get("b", "fp") is None
+    assert cache.get("  a\n", "fp") is not None
+    assert cache.get("a", "other") is None
+
+    stats = cache.stats()
+    assert stats["entries"] == 2
+    assert stats["evictions"] == 1
+    assert stats["hits"] == 2
+    assert stats["misses"] == 2
+    assert stats["memory_bytes"] > 2 * 13 * 8
+
+
+def test_prediction_cache_disk_tier_is_shared_and_capped(tmp_path, monkeypatch):
+    monkeypatch.setattr("ml.cache.PRUNE_INTERVAL", 1)
+    cache = PredictionCache(disk_path=tmp_path / "cache.sqlite", max_disk_entries=2)
+    cache.put("a", "v1:t1", np.ones(13))
+
+    # Another version (or process) on the same file leaves existing entries alone
+    reopened = PredictionCache(disk_path=tmp_path / "cache.sqlite", max_disk_entries=2)
+    reopened.put("a", "v2:t1", np.zeros(13))
+    np.testing.assert_array_equal(reopened.get("a", "v1:t1"), np.ones(13))
+    assert reopened.stats()["disk_hits"] == 1
+
+    # A recalibration is a new key rather than an invalidation
+    assert reopened.get("a", "v1:t2") is None
+
+    # The least recently used row ages out of the disk tier
+    reopened.put("b", "v1:t2", np.ones(13))
+    fresh = PredictionCache(disk_path=tmp_path / "cache.sqlite")
+    assert fresh.get("a", "v2:t1") is None
+    assert fresh.get("a", "v1:t1") is not None
+    assert fresh.get("b", "v1:t2") is not None
+
+
+def test_bootstrap_metrics_match_sklearn():
+    rng = np.random.default_rng(0)
+    y_true = (rng.random((60, 4)) < 0.4).astype(int)
+    y_score = np.round(rng.random((60, 4)), 1)
+    thresholds = np.full(4, 0.5)
+
+    counts = resample_counts(60, 3)
+    samples = bootstrap_metrics(y_true, y_score, thresholds, counts)
+
+    for b in range(3):
+        idx = np.repeat(np.arange(60), counts[b])
+        y_pred = (y_score[idx] >= thresholds).astype(int)
+
+        np.testing.assert_allclose(
+            [samples[name][b] for name in samples],
+            [
+                f1_score(y_true[idx], y_pred, average="macro", zero_division=0),
+                f1_score(y_true[idx], y_pred, average="micro", zero_division=0),
+                roc_auc_score(y_true[idx], y_score[idx], average="macro"),
+                hamming_loss(y_true[idx], y_pred),
+            ],
+        )
+
+
+def test_paired_bootstrap_identical_variants():
+    rng = np.random.default_rng(0)
+    y_true = (rng.random((40, 3)) < 0.5).astype(int)
+    y_score = rng.random((40, 3))
+    variant = (y_score, np.full(3, 0.5))
+
+    summary = paired_bootstrap(y_true, variant, variant, n_resamples=100)
+
+    assert np.allclose(summary["Delta Mean"], 0.0)
+    assert np.all(summary["p"] == 1.0)
+
+
+def test_merge_overlay_overrides_nested_values():
+    base = {"training": {"epochs": {"embedding": 5, "classifier": 16}, "l2_weight": 1e-4}}
+    overlay = {"training": {"epochs": {"embedding": 2}}}
+
+    assert merge_overlay(base, overlay) == {
+        "training": {"epochs": {"embedding": 2, "classifier": 16}, "l2_weight": 1e-4}
+    }
+
+
+def test_cached_tokenizer_matches_tokenizer(model):
+    tokenizer = model.model_body.tokenizer
+    cached = CachedTokenizer(tokenizer)
+    texts = ["I feel great today.", "Everything is terrible and nothing helps.", "I feel great today."]
+    cached.prime(texts, 32)
+
+    kwargs = {"padding": True, "truncation": "longest_first", "return_tensors": "pt", "max_length": 32}
+    expected = tokenizer(texts, **kwargs)
+    actual = cached(texts, **kwargs)
+
+    assert set(actual.keys()) == set(expected.keys())
+    for key in expected:
+        assert actual[key].tolist() == expected[key].tolist()
+    assert len(cached.encodings) == 2
+
+    single = {"max_length": 16, "padding": "max_length", "truncation": True}
+    assert cached(texts[0], **single) is cached(texts[0], **single)
+    assert cached(texts[0], **single)["input_ids"] == tokenizer(texts[0], **single)["input_ids"]
+
+
+def test_split_cores_gives_workers_disjoint_slices():
+    cpu = CpuTrainingConfig(affinity=list(range(8)))
+
+    slices = [split_cores(cpu, index, 3) for index in range(3)]
+
+    assert [worker.affinity for worker in slices] == [[0, 1], [2, 3], [4, 5]]
+    assert all(worker.num_threads == 2 for worker in slices)
+    assert split_cores(cpu, 0, 16).affinity == [0]
+
+
+@pytest.fixture
+def tiny_body(tmp_path):
+    vocab = tmp_path / "vocab.txt"
+    vocab.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "i", "feel", "great"]))
+    BertTokenizerFast(vocab_file=str(vocab)).save_pretrained(tmp_path)
+    config = BertConfig(
+        vocab_size=8, hidden_size=8, num_hidden_layers=4, num_attention_heads=2, intermediate_size=16
+    )
+    BertModel(config).save_pretrained(tmp_path)
+
+    transformer = models.Transformer(str(tmp_path))
+    pooling = models.Pooling(transformer.get_word_embedding_dimension())
+    return SentenceTransformer(modules=[transformer, pooling], device="cpu")
+
+
+def test_drop_alternate_layers_keeps_last_layer(tiny_body):
+    # ml.distill pulls in the ONNX export toolchain via ml.onnx
+    drop_alternate_layers = pytest.importorskip("ml.distill").drop_alternate_layers
+    teacher_layers = tiny_body[0].auto_model.encoder.layer
+
+    student = drop_alternate_layers(tiny_body)
+    student_model = student[0].auto_model
+
+    assert len(student_model.encoder.layer) == 2
+    assert student_model.config.num_hidden_layers == 2
+    assert torch.equal(
+        student_model.encoder.layer[-1].output.dense.weight,
+        teacher_layers[-1].output.dense.weight,
+    )
+
+    assert len(teacher_layers) == 4
+    assert tiny_body[0].auto_model.config.num_hidden_layers == 4
+    assert student.encode(["i feel great"]).shape == (1, 8)
+
+
+def test_fit_head_matches_setfit_fit(tiny_body, monkeypatch):
+    # setfit's tqdm opens an extra DataLoader iterator, which draws a shuffle seed
+    monkeypatch.setattr("setfit.modeling.tqdm", lambda iterable, **kwargs: iterable)
+    head = SetFitHead(in_features=8, out_features=3, multitarget=True)
+    x_train = ["i feel great", "i feel", "great", "feel great", "i", "great great"]
+    y_train = [[1, 0, 1], [0, 1, 0], [1, 0, 0], [0, 0, 1], [0, 1, 1], [1, 1, 0]]
+    args = TrainingArguments(
+        batch_size=2, num_epochs=(1, 7), head_learning_rate=1e-2, l2_weight=0.01, max_length=8
+    )
+
+    def build():
+        return SetFitModel(
+            model_body=copy.deepcopy(tiny_body),
+            model_head=copy.deepcopy(head),
+            multi_target_strategy="one-vs-rest",
+        )
+
+    expected = build()
+    torch.manual_seed(0)
+    expected.fit(
+        x_train,
+        y_train,
+        num_epochs=args.classifier_num_epochs,
+        batch_size=args.classifier_batch_size,
+        body_learning_rate=args.body_classifier_learning_rate,
+        head_learning_rate=args.head_learning_rate,
+        end_to_end=args.end_to_end,
+        l2_weight=args.l2_weight,
+        max_length=args.max_length,
+        show_progress_bar=False,
+    )
+
+    model = build()
+    epochs = []
+    torch.manual_seed(0)
+    fit_head(model, x_train, y_train, args, epochs.append)
+
+    assert epochs == list(range(7))
+    for actual, reference in zip(model.model_head.parameters(), expected.model_head.parameters()):
+        assert torch.equal(actual, reference)
+
+
+def test_cached_tokenizer_copies_and_pickles(tiny_body):
+    cached = CachedTokenizer(tiny_body.tokenizer)
+    cached.prime(["i feel great"], 8)
+
+    for clone in (copy.deepcopy(cached), pickle.loads(pickle.dumps(cached))):
+        assert clone.encodings == cached.encodings
+        assert clone.pad_token == "[PAD]"
+    with pytest.raises(AttributeError):
+        cached.__missing_dunder__
+